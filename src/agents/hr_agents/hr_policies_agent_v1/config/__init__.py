@@ -15,4 +15,12 @@ _RAG_HOST = os.getenv("RAG_HOST", "rag_service")
 _RAG_PORT = os.getenv("RAG_PORT", "8001")
 
 _COLLECTION_NAME = "hr_policies_v4"
-ENDPOINT = f"http://{_RAG_HOST}:{_RAG_PORT}/retrieve/{_COLLECTION_NAME}"
\ No newline at end of file
+ENDPOINT = f"http://{_RAG_HOST}:{_RAG_PORT}/retrieve/{_COLLECTION_NAME}"
+BATCH_ENDPOINT = f"{ENDPOINT}/batch"
+RERANK_ENDPOINT = f"http://{_RAG_HOST}:{_RAG_PORT}/rerank"
+
+# Rank the retrieved documents with the rag_service reranker instead of an LLM call
+USE_RERANK_SERVICE = os.getenv("HR_USE_RERANK_SERVICE", "true").lower() == "true"
+
+# Retrieved chunks farther than this from their query are dropped by the rag_service (unset keeps every hit)
+MAX_DISTANCE = float(os.environ["HR_MAX_DISTANCE"]) if os.getenv("HR_MAX_DISTANCE") else None
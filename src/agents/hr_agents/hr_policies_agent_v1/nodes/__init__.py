@@ -1,11 +1,16 @@
 import json
-import asyncio
 import httpx
 
 from hr_agents.hr_policies_agent_v1.states import HRPoliciesV1_State
 from typing import Literal
 
-from hr_agents.hr_policies_agent_v1.config import ENDPOINT
+from hr_agents.hr_policies_agent_v1.config import (
+    BATCH_ENDPOINT,
+    MAX_DISTANCE,
+    RERANK_ENDPOINT,
+    USE_RERANK_SERVICE,
+    _COLLECTION_NAME,
+)
 from hr_agents.hr_policies_agent_v1.agents import (
     analysis_agent,
     simple_gen_agent,
@@ -133,16 +138,18 @@ async def retrieval(state: HRPoliciesV1_State, writer: StreamWriter):
         "node": "retrieval"
     })
     
-    retrieved_docs = []
-    
-    async def fetch_single(query: str):
-        nonlocal retrieved_docs
-        async with httpx.AsyncClient() as client:
-            r = await client.post(ENDPOINT, json={"query": query, "k": 2}, timeout=30)
-            r.raise_for_status()
-            retrieved_docs.extend(r.json()["documents"])
-    
-    await asyncio.gather(*(fetch_single(q) for q in state["vector_queries"]))
+    # One round trip (and one embedding call) for all the generated queries
+    async with httpx.AsyncClient() as client:
+        payload = {
+            "queries": state["vector_queries"],
+            "k": 2,
+            "mode": "hybrid",
+            "dedup": True,
+            "max_distance": MAX_DISTANCE,
+        }
+        r = await client.post(BATCH_ENDPOINT, json=payload, timeout=30)
+        r.raise_for_status()
+        retrieved_docs = [doc for result in r.json()["results"] for doc in result["documents"]]
     
     writer({
         "type": "reasoning",
@@ -165,6 +172,27 @@ async def doc_ranking(state: HRPoliciesV1_State, config: RunnableConfig, writer:
     retrieved_docs = state['retrieved_content']
     analysis_str = state['analysis_str']
     
+    if USE_RERANK_SERVICE:
+        # Local cross-encoder scoring in the rag_service: no LLM round trip per cycle
+        user_msgs = [m for m in json.loads(state["user_input_json"]) if m.get("role") == "user"]
+        payload = {
+            "query": user_msgs[-1]["content"] if user_msgs else " ".join(state["vector_queries"]),
+            "documents": [doc.get("content", "") for doc in retrieved_docs[-1]],
+            "collection_name": _COLLECTION_NAME,
+        }
+        try:
+            async with httpx.AsyncClient() as client:
+                r = await client.post(RERANK_ENDPOINT, json=payload, timeout=30)
+                r.raise_for_status()
+                relevance_flags = r.json()["relevant"]
+        except httpx.HTTPError:
+            relevance_flags = None
+        
+        if relevance_flags is not None:
+            state_flags = state['ranking_flags']
+            state_flags.extend([relevance_flags])
+            return {"ranking_flags": state_flags}
+    
     formatted_docs = []
     for idx, doc in enumerate(retrieved_docs[-1], start=1):
         metadata = json.dumps(doc.get("metadata", {}), ensure_ascii=False)
@@ -10,15 +10,18 @@ sys.path.append(str(PACKAGE_ROOT))
 from orthodox_agents import orthodoxai_agent_v1
 from hr_agents import hr_policies_agent_v1
 from retail_agents import retail_agent_v1
+from retail_agents.retail_agent_v1.config import SESSION_ENDPOINT
 
 # Load moderation
 # from moderation import moderation_agent
 
 import json
+import uuid
+import httpx
 from fastapi import FastAPI
 from pydantic import BaseModel
 from fastapi.responses import StreamingResponse
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 
 app = FastAPI()
@@ -26,6 +29,7 @@ app = FastAPI()
 class StrRequest(BaseModel):
     """Pydantic model for incoming requests: a list of user input dictionaries."""
     user_input: List[Dict[str, str]]
+    session_id: Optional[str] = None
 
 
 @app.post("/OrthodoxAI/v1/stream", status_code=200)
@@ -50,10 +54,24 @@ async def stream_agent(req: StrRequest):
 
 @app.post("/Retail/v1/stream", status_code=200)
 async def stream_agent(req: StrRequest):
-    """Stream responses from the Retail v1 agent."""
+    """
+    Stream responses from the Retail v1 agent. Turns sent with the same `session_id` share
+    the SQL scratch tables of the conversation; without one, the request gets a session of
+    its own that is dropped once the run finishes.
+    """
+    session_id = req.session_id or uuid.uuid4().hex
     async def event_stream():
-        async for msg in retail_agent_v1.astream({"user_input": req.user_input}, stream_mode="custom"):
-            yield (json.dumps(msg) + "\n").encode(encoding="utf-8")
+        try:
+            async for msg in retail_agent_v1.astream({"user_input": req.user_input, "session_id": session_id}, stream_mode="custom"):
+                yield (json.dumps(msg) + "\n").encode(encoding="utf-8")
+        finally:
+            if req.session_id is None:
+                # 404 when the run never created a scratch table
+                try:
+                    async with httpx.AsyncClient(timeout=10) as client:
+                        await client.delete(SESSION_ENDPOINT + session_id)
+                except httpx.HTTPError:
+                    pass
     
     return StreamingResponse(event_stream(), media_type="text/event-stream")
 
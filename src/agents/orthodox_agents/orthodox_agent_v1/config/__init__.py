@@ -15,4 +15,8 @@ RAG_HOST = os.getenv("RAG_HOST", "rag_service")
 RAG_PORT = os.getenv("RAG_PORT", "8001")
     
 COLLECTION_NAME = "athanasios-muthlinaios"
-ENDPOINT = f"http://{RAG_HOST}:{RAG_PORT}/retrieve/{COLLECTION_NAME}"
\ No newline at end of file
+ENDPOINT = f"http://{RAG_HOST}:{RAG_PORT}/retrieve/{COLLECTION_NAME}"
+BATCH_ENDPOINT = f"{ENDPOINT}/batch"
+
+# Retrieved chunks farther than this from their query are dropped by the rag_service (unset keeps every hit)
+MAX_DISTANCE = float(os.environ["ORTHODOX_MAX_DISTANCE"]) if os.getenv("ORTHODOX_MAX_DISTANCE") else None
@@ -1,10 +1,9 @@
 import json
-import asyncio
 import httpx
 
 from orthodox_agents.orthodox_agent_v1.states import OrthodoxV1_State
 from typing import Literal
-from orthodox_agents.orthodox_agent_v1.config import ENDPOINT
+from orthodox_agents.orthodox_agent_v1.config import BATCH_ENDPOINT, MAX_DISTANCE
 from orthodox_agents.orthodox_agent_v1.agents import (
     analysis_agent,
     simple_gen_agent,
@@ -119,16 +118,19 @@ async def query_gen(state: OrthodoxV1_State, config: RunnableConfig, writer: Str
 
 
 async def retrieval(state: OrthodoxV1_State, writer: StreamWriter):
-    retrieved_docs = []
-
-    async def fetch_single(query: str):
-        nonlocal retrieved_docs
-        async with httpx.AsyncClient() as client:
-            r = await client.post(ENDPOINT, json={"query": query, "k": 10}, timeout=30)
-            r.raise_for_status()
-            retrieved_docs.extend(r.json()["documents"])
-
-    await asyncio.gather(*(fetch_single(q) for q in state["vector_queries"]))
+    # One round trip (and one embedding call) for all the generated queries
+    async with httpx.AsyncClient() as client:
+        payload = {
+            "queries": state["vector_queries"],
+            "k": 10,
+            "mode": "hybrid",
+            "mmr": True,
+            "dedup": True,
+            "max_distance": MAX_DISTANCE,
+        }
+        r = await client.post(BATCH_ENDPOINT, json=payload, timeout=30)
+        r.raise_for_status()
+        retrieved_docs = [doc for result in r.json()["results"] for doc in result["documents"]]
 
     writer({
         "type": "reasoning",
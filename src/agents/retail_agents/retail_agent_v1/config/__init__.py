@@ -20,4 +20,8 @@ RAG_PORT = os.getenv("RAG_PORT", "8001")
 
 ROOT_ENDPOINT = f"http://{RAG_HOST}:{RAG_PORT}/"
 SCHEMA_ENDPOINT = ROOT_ENDPOINT + f"excel/{TABLE}/schema"
-QUERY_ENDPOINT = ROOT_ENDPOINT + f"excel/{TABLE}/query/sql"
\ No newline at end of file
+PROFILE_ENDPOINT = ROOT_ENDPOINT + f"excel/{TABLE}/profile"
+SCHEMA_SEARCH_ENDPOINT = ROOT_ENDPOINT + "excel/schema/search"
+VALUES_ENDPOINT = ROOT_ENDPOINT + f"excel/{TABLE}/values/resolve"
+QUERY_ENDPOINT = ROOT_ENDPOINT + f"excel/{TABLE}/query/sql"
+SESSION_ENDPOINT = ROOT_ENDPOINT + "excel/sessions/"
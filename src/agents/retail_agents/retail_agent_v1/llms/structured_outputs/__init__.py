@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Literal, Optional
+from typing import List, Literal, Optional
 
 
 class AnalysisOutput(BaseModel):
@@ -24,9 +24,24 @@ class AnalysisOutput(BaseModel):
             explaining what it will compute or retrieve according to the user input.
         """
     )
+    filter_values: List[str] = Field(
+        default_factory=list,
+        description="""
+            Only when intent is "data".
+            The literal values the user filters on (countries, products, segments, ...),
+            exactly as the user wrote them; empty when there are none.
+        """
+    )
 
 class SQLQueryOutput(BaseModel):
     sql_query: str = Field(..., description="The generated SQL query.")
+    approximate: bool = Field(
+        False,
+        description="""
+            True for exploratory questions where a fast estimate is good enough
+            (rough totals, shares, trends); False when the user needs exact figures.
+        """
+    )
 
 
 
@@ -1,9 +1,18 @@
+import asyncio
 import json
 import httpx
 
 from retail_agents.retail_agent_v1.states import RetailV1_State
 from typing import Literal
-from retail_agents.retail_agent_v1.config import SCHEMA_ENDPOINT, QUERY_ENDPOINT
+from retail_agents.retail_agent_v1.config import (
+    TABLE,
+    SCHEMA_ENDPOINT,
+    SCHEMA_SEARCH_ENDPOINT,
+    PROFILE_ENDPOINT,
+    QUERY_ENDPOINT,
+    SESSION_ENDPOINT,
+    VALUES_ENDPOINT,
+)
 from retail_agents.retail_agent_v1.agents import (
     analysis_agent,
     simple_gen_agent,
@@ -12,6 +21,8 @@ from retail_agents.retail_agent_v1.agents import (
     answer_agent,
 )
 
+from retail_agents.retail_agent_v1.validation import schema_tables, validate_sql
+
 from retail_agents.retail_agent_v1.prompts.templates import (
     schema_help_template,
     answer_gen_template
@@ -22,10 +33,20 @@ from langgraph.types import StreamWriter
 from langchain_core.messages.ai import AIMessageChunk
 
 
+def prune_profile(profile: dict, columns: set[str]) -> dict:
+    """Keep only the profile of the given columns, also in the sample rows."""
+    return {
+        **profile,
+        "columns": [column for column in profile["columns"] if column["column"] in columns],
+        "samples": [{key: value for key, value in row.items() if key in columns} for row in profile["samples"]],
+    }
+
+
 async def analysis(state: RetailV1_State, config: RunnableConfig, writer: StreamWriter) -> RetailV1_State:
     """
     Analyze user input to extract intent, reasoning, and SQL description,
-    then fetch and store the database schema.
+    then fetch and store the database schema and column profile. For data
+    questions both are pruned to the columns relevant to the question.
     """
     writer({
         "type": "reasoning",
@@ -49,12 +70,39 @@ async def analysis(state: RetailV1_State, config: RunnableConfig, writer: Stream
     async with httpx.AsyncClient(timeout=10) as client:
         r = await client.get(SCHEMA_ENDPOINT)
         r.raise_for_status()
-        db_schema_json = r.json()
+        db_schema_json = db_full_schema_json = r.json()
+        
+        # Value ranges and frequent values ground the SQL filters; the agent still works without them
+        try:
+            r = await client.get(PROFILE_ENDPOINT)
+            r.raise_for_status()
+            db_profile_json = r.json()
+        except httpx.HTTPError:
+            db_profile_json = "N/A"
+        
+        # SQL prompts only need the columns the question is about; fall back to the full schema
+        if analysis_results.intent == "data":
+            question = " ".join(filter(None, [
+                analysis_results.sql_description,
+                " ".join(message.get("content", "") for message in user_msg if message.get("role") in {"user", "human"}),
+            ]))
+            try:
+                r = await client.post(SCHEMA_SEARCH_ENDPOINT, json={"question": question, "tables": [TABLE]})
+                r.raise_for_status()
+                [relevant] = r.json()["tables"]
+                if relevant["pruned"]:
+                    db_schema_json = relevant["columns"]
+                    if isinstance(db_profile_json, dict):
+                        db_profile_json = prune_profile(db_profile_json, {column["column"] for column in relevant["columns"]})
+            except (httpx.HTTPError, KeyError, ValueError):
+                pass
     
     return {
         'analysis_results': analysis_results,
         'analysis_str': analysis_str,
         'db_schema_json': db_schema_json,
+        'db_full_schema_json': db_full_schema_json,
+        'db_profile_json': db_profile_json,
         "user_input_json": json.dumps(user_msg),
     }   
 
@@ -129,14 +177,42 @@ async def query_gen(state: RetailV1_State, config: RunnableConfig, writer: Strea
     error_message = state["error_message"]
     table_name = state["table_name"]
     db_schema_json = state["db_schema_json"]
+    db_profile_json = state["db_profile_json"]
     analysis_str = state["analysis_str"]
     sql_query = state["sql_query"]
+    resolved_values_json = state["resolved_values_json"]
+    
+    async with httpx.AsyncClient(timeout=10) as client:
+        # Intermediate tables kept by earlier steps of this session; a new session has none yet
+        scratch_tables_json = "[]"
+        if state["session_id"] is not None:
+            try:
+                r = await client.get(SESSION_ENDPOINT + state["session_id"])
+                r.raise_for_status()
+                scratch_tables_json = json.dumps(r.json()["tables"], ensure_ascii=False)
+            except httpx.HTTPError:
+                pass
+        
+        # Map the filter values as the user wrote them to the stored spellings, once per question
+        if resolved_values_json is None:
+            resolved_values_json = "N/A"
+            filter_values = state["analysis_results"].filter_values
+            if filter_values:
+                try:
+                    r = await client.post(VALUES_ENDPOINT, json={"terms": filter_values})
+                    r.raise_for_status()
+                    resolved_values_json = json.dumps(r.json()["results"], ensure_ascii=False)
+                except httpx.HTTPError:
+                    pass
     
     if error_message:
         # Include error context for retry
         payload = {
             "table_name": table_name,
             "db_schema_json": db_schema_json,
+            "db_profile_json": db_profile_json,
+            "scratch_tables_json": scratch_tables_json,
+            "resolved_values_json": resolved_values_json,
             "analysis_str": analysis_str,
             "error_message": error_message,
             "sql_query": sql_query,
@@ -148,11 +224,59 @@ async def query_gen(state: RetailV1_State, config: RunnableConfig, writer: Strea
         payload = {
             "table_name": table_name,
             "db_schema_json": db_schema_json,
+            "db_profile_json": db_profile_json,
+            "scratch_tables_json": scratch_tables_json,
+            "resolved_values_json": resolved_values_json,
             "analysis_str": analysis_str,
         }
         sql_output = await sql_gen_agent.ainvoke(payload, config)
     
-    return {"sql_query": sql_output.sql_query, "sql_cycle": state["sql_cycle"] + 1}
+    return {
+        "sql_query": sql_output.sql_query,
+        "sql_approximate": sql_output.approximate,
+        "resolved_values_json": resolved_values_json,
+        "scratch_tables_json": scratch_tables_json,
+        "sql_cycle": state["sql_cycle"] + 1,
+    }
+
+
+
+async def query_validation(state: RetailV1_State, writer: StreamWriter) -> RetailV1_State:
+    """
+    Check the generated SQL locally against the cached schema (parse, read-only statements,
+    table and column names, types), so obviously invalid SQL never reaches the SQL service.
+    """
+    writer({
+        "type": "reasoning",
+        "content": "🔎 Validating SQL query against the schema...",
+        "node": "sql_query_validation"
+    })
+    
+    tables = schema_tables(state["table_name"], state["db_full_schema_json"], json.loads(state["scratch_tables_json"] or "[]"))
+    error = await asyncio.to_thread(validate_sql, state["sql_query"], tables)
+    if error is None:
+        return {"error_message": None}
+    
+    return {
+        "sql_results": None,
+        "error_message": f"SQL validation failed: {json.dumps(error, ensure_ascii=False)}",
+    }
+
+
+
+async def check_sql_validation(state: RetailV1_State, writer: StreamWriter) -> Literal["query_execution", "query_gen", "complex_generation"]:
+    """
+    Send valid SQL on for execution; otherwise retry the generation with the
+    validation error (up to 2 attempts) before answering without results.
+    """
+    if state["error_message"] is None:
+        return "query_execution"
+    writer({
+        "type": "reasoning",
+        "content": "❌ SQL query failed validation",
+        "node": "sql_query_validation"
+    })
+    return "query_gen" if state["sql_cycle"] < 2 else "complex_generation"
 
 
 
@@ -168,10 +292,11 @@ async def query_execution(state: RetailV1_State, writer: StreamWriter, config: R
     })
     
     sql_query = state["sql_query"]
+    payload = {"sql": sql_query, "approximate": state["sql_approximate"], "session_id": state["session_id"]}
     
     try:
         async with httpx.AsyncClient(timeout=10) as client:
-            r = await client.post(QUERY_ENDPOINT, json={"sql": sql_query}, timeout=30)
+            r = await client.post(QUERY_ENDPOINT, json=payload, timeout=30)
             r.raise_for_status()
             response = r.json()
     except httpx.HTTPStatusError as exc:
@@ -181,6 +306,10 @@ async def query_execution(state: RetailV1_State, writer: StreamWriter, config: R
         except Exception:
             detail = exc.response.text or str(exc)
 
+        # Guardrail rejections carry a structured detail (code, message, hint, ...)
+        if isinstance(detail, dict):
+            detail = json.dumps(detail, ensure_ascii=False)
+
         return {
             "sql_results": None,
             "error_message": f"HTTP {exc.response.status_code}: {detail}",
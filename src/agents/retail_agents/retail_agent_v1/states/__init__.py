@@ -12,13 +12,19 @@ class RetailV1_State(BaseModel):
     user_input: Union[List[Dict[str, str]], ChatPromptTemplate, List[BaseMessage]]
     user_input_json: str = None
     db_schema_json: str = None
+    db_full_schema_json: Any = None
+    db_profile_json: Any = None
+    resolved_values_json: str = None
     table_name: str = TABLE
+    session_id: str = None
     
     analysis_results: Any = None
     analysis_str: str = None
     
     error_message: str = None
     sql_query: str = None
+    sql_approximate: bool = False
+    scratch_tables_json: str = None
     sql_results: Any = None
     
     response: str = None
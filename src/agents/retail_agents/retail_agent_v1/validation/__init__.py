@@ -0,0 +1,128 @@
+import json
+import re
+from typing import Dict, List, Optional
+
+import duckdb
+
+
+# Besides queries, only temp tables/views that keep intermediates in the session's scratch schema
+SCRATCH_CREATE_RE = re.compile(
+    r"^\s*CREATE\s+(?:OR\s+REPLACE\s+)?TEMP(?:ORARY)?\s+(TABLE|VIEW)\s+(?:IF\s+NOT\s+EXISTS\s+)?(.+?)\s+AS\s+(.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# DuckDB errors mapped to a code and a repair hint: (exception type, message pattern or None, code, hint)
+ERROR_CODES = [
+    (duckdb.ParserException, None, "syntax_error",
+     "Fix the SQL syntax; quote column names that contain spaces or capitals with double quotes."),
+    (duckdb.CatalogException, r"Table with name|Table .* does not exist", "unknown_table",
+     "Query the table named in the context, or a scratch table listed there."),
+    (duckdb.BinderException, r"Referenced column|not found in FROM clause", "unknown_column",
+     "Use only the columns of the schema, spelled and quoted exactly as listed."),
+    (duckdb.BinderException, r"GROUP BY|aggregate function", "grouping_error",
+     "Add every selected column that is not aggregated to GROUP BY."),
+    (duckdb.BinderException, r"No function matches|Cannot compare|Cannot mix|Cannot (implicitly )?cast", "type_mismatch",
+     "Use functions and comparisons that fit the column types; cast explicitly where needed."),
+    (duckdb.ConversionException, None, "type_mismatch",
+     "Compare each column with a literal of its type (numbers unquoted, dates as 'YYYY-MM-DD')."),
+]
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _error(code: str, message: str, hint: str, statement: Optional[int] = None) -> Dict:
+    error = {"code": code, "message": message, "hint": hint}
+    if statement is not None:
+        error["statement"] = statement
+    return error
+
+
+def _table_functions(node) -> List[str]:
+    """Names of the table functions (range, read_csv, glob, ...) anywhere in a parse tree."""
+    if isinstance(node, list):
+        return [name for item in node for name in _table_functions(item)]
+    if not isinstance(node, dict):
+        return []
+    names = [node["function"]["function_name"]] if node.get("type") == "TABLE_FUNCTION" else []
+    return names + [name for value in node.values() for name in _table_functions(value)]
+
+
+def _classify(exc: duckdb.Error, statement: int) -> Dict:
+    message = str(exc).strip()
+    for error_type, pattern, code, hint in ERROR_CODES:
+        if isinstance(exc, error_type) and (pattern is None or re.search(pattern, message)):
+            return _error(code, message, hint, statement)
+    return _error("invalid_sql", message, "Rewrite the query so it runs on the schema given.", statement)
+
+
+def validate_sql(sql: str, tables: Dict[str, Dict[str, str]]) -> Optional[Dict]:
+    """
+    Check SQL against the cached schema without contacting the SQL service: it must parse,
+    hold only SELECT statements (and temp tables/views for intermediates), read no table
+    functions and bind against empty copies of `tables` ({table: {column: type}}). Nothing is
+    executed. Returns a structured error ({"code", "message", "hint", "statement"}) or None
+    if the SQL is valid.
+    """
+    try:
+        statements = duckdb.extract_statements(sql)
+    except duckdb.Error as exc:
+        return _classify(exc, 0)
+    if not statements:
+        return _error("empty_sql", "The SQL contains no statement.", "Return a single SELECT query.")
+
+    queries = []
+    for index, statement in enumerate(statements):
+        create = SCRATCH_CREATE_RE.match(statement.query) if statement.type == duckdb.StatementType.CREATE else None
+        if statement.type != duckdb.StatementType.SELECT and create is None:
+            return _error(
+                "statement_not_allowed",
+                f"Statement {index + 1} is a {statement.type.name} statement; only SELECT queries can be run.",
+                "Return a read-only SELECT query, optionally preceded by CREATE TEMP TABLE <name> AS SELECT ...",
+                index,
+            )
+        queries.append((create, create.group(3) if create else statement.query))
+
+    con = duckdb.connect()
+    try:
+        try:
+            for table, columns in tables.items():
+                con.execute(f"CREATE TABLE {_quote(table)} ({', '.join(f'{_quote(column)} {dtype}' for column, dtype in columns.items())})")
+        except duckdb.Error:
+            return None  # a schema we can't mirror locally; the SQL service has the final word
+        con.execute("SET enable_external_access = false")
+        con.execute("SET lock_configuration = true")
+
+        for index, (create, query) in enumerate(queries):
+            ast = json.loads(con.execute("SELECT json_serialize_sql(?)", [query]).fetchone()[0])
+            functions = [] if ast.get("error") else _table_functions(ast)
+            if functions:
+                return _error(
+                    "statement_not_allowed",
+                    f"Statement {index + 1} reads the table function {functions[0]}(); only tables can be queried.",
+                    "Query the table named in the context, or a scratch table listed there.",
+                    index,
+                )
+            try:
+                # DESCRIBE binds the query (names, types, grouping) without running it
+                columns = con.execute(f"DESCRIBE {query}").fetchall()
+                if create is not None:
+                    kind, name = create.group(1).upper(), create.group(2)
+                    if kind == "VIEW":
+                        con.execute(f"CREATE OR REPLACE TEMP VIEW {name} AS {query}")
+                    else:
+                        con.execute(f"CREATE OR REPLACE TEMP TABLE {name} ({', '.join(f'{_quote(column)} {dtype}' for column, dtype, *_ in columns)})")
+            except duckdb.Error as exc:
+                return _classify(exc, index)
+        return None
+    finally:
+        con.close()
+
+
+def schema_tables(table_name: str, schema: List[Dict], scratch_tables: List[Dict]) -> Dict[str, Dict[str, str]]:
+    """The tables to validate against: the queried table and the session's scratch tables."""
+    tables = {table_name: {column["column"]: column["type"] for column in schema}}
+    for scratch in scratch_tables:
+        tables.setdefault(scratch["table"], scratch["columns"])
+    return tables
@@ -3,6 +3,8 @@ from retail_agents.retail_agent_v1.nodes import (
     check_intent,
     simple_generation,
     query_gen,
+    query_validation,
+    check_sql_validation,
     query_execution,
     check_sql_results,
     complex_generation,
@@ -19,6 +21,7 @@ workflow = StateGraph(RetailV1_State)
 workflow.add_node("analysis", analysis)
 workflow.add_node("simple_generation", simple_generation)
 workflow.add_node("query_gen", query_gen)
+workflow.add_node("query_validation", query_validation)
 workflow.add_node("query_execution", query_execution)
 workflow.add_node("complex_generation", complex_generation)
 
@@ -33,7 +36,16 @@ workflow.add_conditional_edges(
     },
 )
 workflow.add_edge("simple_generation", END)
-workflow.add_edge("query_gen", "query_execution")
+workflow.add_edge("query_gen", "query_validation")
+workflow.add_conditional_edges(
+    "query_validation",
+    check_sql_validation,
+    {
+        "query_execution": "query_execution",
+        "query_gen": "query_gen",
+        "complex_generation": "complex_generation",
+    },
+)
 workflow.add_conditional_edges(
     "query_execution",
     check_sql_results,
@@ -0,0 +1,233 @@
+import asyncio
+import threading
+from statistics import NormalDist
+
+import duckdb
+
+from config import APPROX_SAMPLE_ROWS, APPROX_MIN_ROWS, APPROX_CONFIDENCE
+from excel_store import ExcelCatalog, excel_tables, sql_identifier
+from sql_ast import (
+    UNSUPPORTED_CLASSES,
+    NotCovered,
+    deserialize,
+    is_aggregate,
+    is_grouped,
+    keep_column_names,
+    parse,
+    parse_expression,
+    retarget,
+    single_table_select,
+    with_node,
+)
+from sql_results import sql_executor
+
+SAMPLE_SCHEMA = "samples"
+# Totals are scaled up from the sample; the other aggregates estimate directly
+SCALED_AGGREGATES = {"sum", "count", "count_star"}
+UNSCALED_AGGREGATES = {
+    "avg", "mean", "min", "max", "median", "quantile_cont", "quantile_disc",
+    "stddev", "stddev_samp", "stddev_pop", "variance", "var_samp", "var_pop",
+}
+# Confidence interval half-widths under simple random sampling without replacement, with
+# {N} table rows, {n} sample rows and {z} the normal quantile. Totals use the variance of
+# y = x * [row in group] over the whole sample, so groups need no extra pass.
+_HALF_WIDTHS = {
+    "sum": "{z} * sqrt({N} * {N} * (1 - {n} / {N}) / {n} * greatest(sum(__x::DOUBLE * __x::DOUBLE) - sum(__x::DOUBLE) * sum(__x::DOUBLE) / {n}, 0) / ({n} - 1))",
+    "count": "{z} * sqrt({N} * {N} * (1 - {n} / {N}) / {n} * greatest(count(__x) - count(__x) * count(__x) / {n}, 0) / ({n} - 1))",
+    "count_star": "{z} * sqrt({N} * {N} * (1 - {n} / {N}) / {n} * greatest(count(*) - count(*) * count(*) / {n}, 0) / ({n} - 1))",
+    "avg": "{z} * sqrt((1 - {n} / {N}) * var_samp(__x) / count(__x))",
+}
+_HALF_WIDTHS["mean"] = _HALF_WIDTHS["avg"]
+
+
+class TableSamples:
+    """
+    Reservoir samples of the large tables, kept per table version, and the rewrite of
+    aggregate queries to estimate their answer from the sample.
+
+    Tables over `min_rows` rows get a `sample_rows` reservoir sample in every DuckDB
+    instance of the catalog; smaller ones are always answered exactly. In a rewritten
+    query SUM and COUNT are scaled by table rows / sample rows, AVG, MIN, MAX and the
+    other intensive aggregates are taken as is, and every top-level SUM, COUNT and AVG
+    gets `<column>_ci_low` / `<column>_ci_high` columns with its confidence interval.
+    """
+
+    def __init__(self, catalog: ExcelCatalog, sample_rows: int, min_rows: int, confidence: float = 0.95):
+        self.catalog = catalog
+        self.sample_rows = sample_rows
+        self.min_rows = min_rows
+        self.confidence = confidence
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+        self._built: dict[str, tuple[int, int, int | None]] = {}  # table -> (version, table rows, sample rows)
+        self._hits = 0
+        self._refreshing: asyncio.Task | None = None
+        self._lock = threading.Lock()
+
+    # ----------------------------------------------------------------------------------
+    # Samples
+    # ----------------------------------------------------------------------------------
+    def _build(self, table: str) -> tuple[int, int | None]:
+        """Sample the table in every instance; returns its row count and the sample size (None if not sampled)."""
+        cursor = self.catalog.db.cursor()
+        try:
+            rows = cursor.execute(f"SELECT count(*) FROM {sql_identifier(table)}").fetchone()[0]
+        finally:
+            cursor.close()
+        sampled = rows > self.min_rows
+        for db in self.catalog.dbs.values():
+            cursor = db.cursor()
+            try:
+                cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {SAMPLE_SCHEMA}")
+                if sampled:
+                    cursor.execute(
+                        f"CREATE OR REPLACE TABLE {SAMPLE_SCHEMA}.{sql_identifier(table)} AS SELECT * FROM {sql_identifier(table)} "
+                        f"USING SAMPLE reservoir({self.sample_rows} ROWS) REPEATABLE (42)"
+                    )
+                else:
+                    cursor.execute(f"DROP TABLE IF EXISTS {SAMPLE_SCHEMA}.{sql_identifier(table)}")
+            finally:
+                cursor.close()
+        return rows, min(self.sample_rows, rows) if sampled else None
+
+    async def refresh(self) -> None:
+        """Resample the tables whose version changed since they were sampled."""
+        with self._lock:
+            for table in set(self._built) - set(self.catalog.tables):
+                del self._built[table]
+        for table, meta in list(self.catalog.tables.items()):
+            with self._lock:
+                built = self._built.get(table)
+            if built is not None and built[0] == meta["version"]:
+                continue
+            try:
+                rows, sample_rows = await sql_executor.run(self._build, table)
+            except Exception as exc:
+                print(f"[WARN] Could not sample table '{table}': {exc}")
+                continue
+            with self._lock:
+                self._built[table] = (meta["version"], rows, sample_rows)
+
+    def schedule_refresh(self) -> None:
+        """Start a background refresh unless one is already running."""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self.refresh())
+
+    def close(self) -> None:
+        if self._refreshing is not None:
+            self._refreshing.cancel()
+
+    # ----------------------------------------------------------------------------------
+    # Rewrite
+    # ----------------------------------------------------------------------------------
+    def _estimate(self, cursor, expression, scale: float, found: list):
+        if isinstance(expression, list):
+            return [self._estimate(cursor, item, scale, found) for item in expression]
+        if not isinstance(expression, dict):
+            return expression
+
+        if expression.get("class") in UNSUPPORTED_CLASSES:
+            raise NotCovered
+        if is_aggregate(cursor, expression):
+            name = expression["function_name"].lower()
+            if expression["distinct"] or expression["filter"] is not None:
+                raise NotCovered
+            found.append(expression)
+            if name in UNSCALED_AGGREGATES:
+                return expression
+            if name not in SCALED_AGGREGATES:
+                raise NotCovered
+            scaled = parse_expression(cursor, f"(__agg * {scale!r}::DOUBLE)", __agg={**expression, "alias": ""})
+            scaled["alias"] = expression["alias"]
+            return scaled
+        return {key: self._estimate(cursor, value, scale, found) for key, value in expression.items()}
+
+    def _interval(self, cursor, aggregate: dict, estimate: dict, column: str, rows: int, sample_rows: int) -> list[dict]:
+        name = aggregate["function_name"].lower()
+        children = aggregate["children"]
+        if name not in _HALF_WIDTHS or (name != "count_star" and len(children) != 1):
+            return []
+        half = _HALF_WIDTHS[name].format(z=self.z, N=float(rows), n=float(sample_rows))
+        placeholders = {"__x": children[0]} if children else {}
+        half_width = parse_expression(cursor, half, **placeholders)
+        bounds = []
+        for suffix, sign in (("ci_low", "-"), ("ci_high", "+")):
+            bound = parse_expression(cursor, f"(__estimate {sign} __half)", __estimate={**estimate, "alias": ""}, __half=half_width)
+            bound["alias"] = f"{column}_{suffix}"
+            bounds.append(bound)
+        return bounds
+
+    def rewrite(self, cursor: duckdb.DuckDBPyConnection, sql: str) -> tuple[str, dict] | None:
+        """
+        Rewrite an aggregate query over a sampled table to read its sample; returns the SQL and
+        the estimate's metadata, or None when the query has to run exactly.
+        """
+        ast = parse(cursor, sql)
+        try:
+            node, source = single_table_select(ast)
+        except NotCovered:
+            return None
+        table = source["table_name"].lower()
+        with self._lock:
+            built = self._built.get(table)
+        current = self.catalog.tables.get(table)
+        if built is None or current is None or built[0] != current["version"] or built[2] is None:
+            return None
+        _, rows, sample_rows = built
+
+        found: list[dict] = []
+        try:
+            rewritten = {
+                key: value if key == "from_table" else self._estimate(cursor, value, rows / sample_rows, found)
+                for key, value in node.items()
+            }
+        except (NotCovered, KeyError, TypeError):
+            return None
+        if not found and not is_grouped(node):
+            return None  # plain rows can't be estimated
+
+        keep_column_names(cursor, sql, node["select_list"], rewritten["select_list"])
+        names = [row[0] for row in cursor.execute(f"DESCRIBE {sql}").fetchall()]
+        intervals = []
+        for item, estimate, column in zip(node["select_list"], rewritten["select_list"], names):
+            if is_aggregate(cursor, item):
+                intervals += self._interval(cursor, item, estimate, column, rows, sample_rows)
+        rewritten["select_list"] = rewritten["select_list"] + intervals
+        rewritten["from_table"] = retarget(source, SAMPLE_SCHEMA, table)
+
+        with self._lock:
+            self._hits += 1
+        return deserialize(cursor, with_node(ast, rewritten)), {
+            "approximate": True,
+            "confidence": self.confidence,
+            "sample_rows": sample_rows,
+            "table_rows": rows,
+        }
+
+    async def rewrite_async(self, db: duckdb.DuckDBPyConnection, sql: str) -> tuple[str, dict] | None:
+        """`rewrite` on the SQL pool with a cursor of its own; stale samples are rebuilt in the background."""
+        with self._lock:
+            built = dict(self._built)
+        if any(built.get(table, (None,))[0] != meta["version"] for table, meta in self.catalog.tables.items()):
+            self.schedule_refresh()
+
+        cursor = db.cursor()
+        try:
+            return await sql_executor.run(self.rewrite, cursor, sql, cursor=cursor)
+        except duckdb.Error:
+            return None  # the query itself reports the error when it runs
+        finally:
+            cursor.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "tables": {
+                    table: {"version": version, "rows": rows, "sample_rows": sample_rows}
+                    for table, (version, rows, sample_rows) in self._built.items()
+                },
+            }
+
+
+table_samples = TableSamples(excel_tables, APPROX_SAMPLE_ROWS, APPROX_MIN_ROWS, APPROX_CONFIDENCE)
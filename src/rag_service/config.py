@@ -1,53 +1,160 @@
+import json
 import os
-import re
 from pathlib import Path
 
 from chromadb.config import Settings
-from langchain_openai import OpenAIEmbeddings
 
-import duckdb
-import pandas as pd
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "cache"))
 
 # --------------------------------------------------------------------------------------
 # Excel db Configs
 # --------------------------------------------------------------------------------------
-DATA_DIR = Path("data")
-
-db = duckdb.connect(database=":memory:")
-TABLES: dict[str, dict] = {}  # table_name -> metadata (file path, columns)
-
-if not DATA_DIR.exists():
-    raise FileNotFoundError(f"DATA_DIR '{DATA_DIR}' does not exist – create it and add Excel files.")
-
-for file_path in DATA_DIR.iterdir():
-    if file_path.suffix.lower() in {".xlsx", ".xls", ".xlsm"} and file_path.is_file():
-        # Sanitise table name: "Financial Sample.xlsx" ➜ "financial_sample"
-        raw_name = file_path.stem
-        safe_name = re.sub(r"\W+", "_", raw_name).strip("_").lower()
-        try:
-            df = pd.read_excel(file_path, sheet_name=0)  # first sheet only
-        except Exception as exc:
-            print(f"[WARN] Could not read {file_path.name}: {exc}")
-            continue
-            
-        db.register(safe_name, df)
-        TABLES[safe_name] = {
-            "table_name": safe_name,
-            "schema": {col: str(dtype) for col, dtype in df.dtypes.items()},
-        }
-
-if not TABLES:
-    raise RuntimeError("No Excel workbooks were successfully loaded from 'data/'.")
+# Every .parquet, .csv/.tsv, .arrow/.feather/.ipc and Excel file of DATA_DIR is a table.
+# Parquet and CSV files are scanned in place; Arrow IPC files are converted once to Parquet
+DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
+
+# Workbooks are loaded once into DuckDB files under EXCEL_CACHE_DIR (keyed by content hash),
+# one table per sheet, read with EXCEL_ENGINE ("calamine" needs python-calamine) by up to
+# EXCEL_WORKERS processes. The first sheet is named after the file, the others "<file>_<sheet>"
+EXCEL_CACHE_DIR = CACHE_DIR / "excel"
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "calamine")
+EXCEL_WORKERS = int(os.getenv("EXCEL_WORKERS", str(os.cpu_count() or 1)))
+
+# Reload added or changed files as soon as they land in DATA_DIR (needs watchfiles)
+EXCEL_WATCH = os.getenv("EXCEL_WATCH", "false").lower() == "true"
+
+# SQL results are streamed in Arrow record batches of SQL_BATCH_SIZE rows; paginated
+# results keep their open reader for SQL_CURSOR_TTL seconds, at most SQL_MAX_CURSORS at once
+SQL_BATCH_SIZE = int(os.getenv("SQL_BATCH_SIZE", "10000"))
+SQL_CURSOR_TTL = float(os.getenv("SQL_CURSOR_TTL", "300"))
+SQL_MAX_CURSORS = int(os.getenv("SQL_MAX_CURSORS", "64"))
+
+# DuckDB queries run on a pool of SQL_WORKERS threads, each on a cursor of its own, and are
+# interrupted when the client disconnects (checked every SQL_DISCONNECT_POLL seconds)
+SQL_WORKERS = int(os.getenv("SQL_WORKERS", str(min(8, os.cpu_count() or 1))))
+SQL_DISCONNECT_POLL = float(os.getenv("SQL_DISCONNECT_POLL", "0.5"))
+
+# Guardrails per query class. Each class gets a DuckDB instance of its own with the given
+# memory_limit and threads; its queries are interrupted after `timeout` seconds, read-only
+# queries get LIMIT `max_rows` injected, and plans whose EXPLAIN estimate exceeds `max_cost`
+# (rows processed over all operators) are rejected before they run. None disables a limit.
+SQL_QUERY_CLASSES: dict[str, dict] = {
+    "interactive": {"timeout": 15.0, "max_rows": 10_000, "max_cost": 1e9, "memory_limit": "1GB", "threads": 2},
+    "batch": {"timeout": 120.0, "max_rows": 1_000_000, "max_cost": 1e11, "memory_limit": "4GB", "threads": 4},
+}
+DEFAULT_SQL_QUERY_CLASS = os.getenv("DEFAULT_SQL_QUERY_CLASS", "interactive")
+
+# Table profiles: most frequent values listed per categorical column and sample rows per table
+PROFILE_TOP_K = int(os.getenv("PROFILE_TOP_K", "10"))
+PROFILE_SAMPLE_ROWS = int(os.getenv("PROFILE_SAMPLE_ROWS", "5"))
+
+# Value dictionaries: the distinct values of text columns with at most VALUE_DICT_MAX_VALUES of
+# them, built per table version, resolve a user's spelling of a filter value to the stored one.
+# Fuzzy matches need a trigram similarity of at least VALUE_MATCH_THRESHOLD (0-1).
+VALUE_DICT_MAX_VALUES = int(os.getenv("VALUE_DICT_MAX_VALUES", "10000"))
+VALUE_MATCH_THRESHOLD = float(os.getenv("VALUE_MATCH_THRESHOLD", "0.5"))
+
+# Schema search: columns are ranked for a question by BM25 over their names, descriptions and
+# profiled values; SCHEMA_TOP_K columns are returned by default. Descriptions are read from
+# SCHEMA_DESCRIPTIONS_PATH: {"<table>": {"description": "...", "columns": {"<column>": "..."}}}
+SCHEMA_TOP_K = int(os.getenv("SCHEMA_TOP_K", "12"))
+SCHEMA_DESCRIPTIONS_PATH = Path(os.getenv("SCHEMA_DESCRIPTIONS_PATH", str(DATA_DIR / "descriptions.json")))
+
+# Materialized rollups: group-by tables over `dimensions` holding sum/count/min/max of each
+# measure. Aggregate queries whose grouping and filters only use those dimensions are
+# rewritten to read the rollup, which is rebuilt whenever its table's version changes.
+SQL_ROLLUPS: dict[str, dict] = {
+    "financial_sample_monthly": {
+        "table": "financial_sample",
+        "dimensions": ["Segment", "Country", "Product", "Discount Band", "Date", "Year", "Month Number", "Month Name"],
+        "measures": ["Units Sold", "Manufacturing Price", "Sale Price", "Gross Sales", "Discounts", " Sales", "COGS", "Profit"],
+    },
+    "financial_sample_segment_country_product": {
+        "table": "financial_sample",
+        "dimensions": ["Segment", "Country", "Product", "Year"],
+        "measures": ["Units Sold", "Gross Sales", "Discounts", " Sales", "COGS", "Profit"],
+    },
+}
+
+# Approximate queries: tables over APPROX_MIN_ROWS rows keep a reservoir sample of
+# APPROX_SAMPLE_ROWS rows, and estimates come with APPROX_CONFIDENCE confidence intervals
+APPROX_SAMPLE_ROWS = int(os.getenv("APPROX_SAMPLE_ROWS", "100000"))
+APPROX_MIN_ROWS = int(os.getenv("APPROX_MIN_ROWS", "1000000"))
+APPROX_CONFIDENCE = float(os.getenv("APPROX_CONFIDENCE", "0.95"))
+
+# Scratch schemas: queries with a session id resolve and create tables (also CREATE TEMP TABLE)
+# in a schema of that session, dropped once idle for SCRATCH_TTL seconds. A session holds at
+# most SCRATCH_MAX_BYTES (estimated from row counts and column types); beyond SCRATCH_MAX_SESSIONS
+# sessions the least recently used one is dropped.
+SCRATCH_TTL = float(os.getenv("SCRATCH_TTL", "1800"))
+SCRATCH_MAX_BYTES = int(os.getenv("SCRATCH_MAX_BYTES", str(256 * 1024 * 1024)))
+SCRATCH_MAX_SESSIONS = int(os.getenv("SCRATCH_MAX_SESSIONS", "64"))
+
+# Result cache of read-only SQL (Arrow tables): total budget and largest single result, in bytes
+SQL_CACHE_MAX_BYTES = int(os.getenv("SQL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+SQL_CACHE_MAX_RESULT_BYTES = int(os.getenv("SQL_CACHE_MAX_RESULT_BYTES", str(16 * 1024 * 1024)))
 
 
 # --------------------------------------------------------------------------------------
 # RAG Configs
 # --------------------------------------------------------------------------------------
-RAG_HOST = os.getenv("RAG_HOST")
-RAG_PORT = os.getenv("RAG_PORT")
-embeddings_model = OpenAIEmbeddings(model='text-embedding-3-large', api_key=os.getenv("OPENAI_API_KEY"))
+RAG_HOST = os.getenv("RAG_HOST", "vectordb")
+RAG_PORT = os.getenv("RAG_PORT", "8000")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 settings = Settings(
     chroma_api_impl="rest",
     chroma_server_host=RAG_HOST,
     chroma_server_http_port=RAG_PORT
 )
+
+# Chroma client pool: how many collection handles to keep, for how long (seconds),
+# how often (seconds) to heartbeat the server before reusing the client and how
+# often (seconds) to re-read a collection's version stamp.
+CHROMA_MAX_COLLECTIONS = int(os.getenv("CHROMA_MAX_COLLECTIONS", "32"))
+CHROMA_COLLECTION_TTL = float(os.getenv("CHROMA_COLLECTION_TTL", "600"))
+CHROMA_HEALTH_INTERVAL = float(os.getenv("CHROMA_HEALTH_INTERVAL", "30"))
+CHROMA_VERSION_INTERVAL = float(os.getenv("CHROMA_VERSION_INTERVAL", "30"))
+
+# Embedders: each entry names a backend registered in `embeddings.py` and its arguments.
+# Collections map to an embedder through COLLECTION_EMBEDDERS (a JSON object in the env,
+# e.g. {"hr_policies_v4": "openai-3-large"}); unlisted ones use DEFAULT_EMBEDDER.
+# The collection must have been ingested with the same model.
+EMBEDDERS: dict[str, dict] = {
+    "openai-3-large": {"backend": "openai", "model": "text-embedding-3-large"},
+    "nomic": {
+        "backend": "local",
+        "model": "nomic-ai/nomic-embed-text-v1.5",
+        "query_prefix": "search_query: ",
+        "document_prefix": "search_document: ",
+        "trust_remote_code": True,
+    },
+    "mxbai": {
+        "backend": "local",
+        "model": "mixedbread-ai/mxbai-embed-large-v1",
+        "query_prefix": "Represent this sentence for searching relevant passages: ",
+    },
+    "hashing": {"backend": "hashing", "dim": 384, "cache": False},
+}
+DEFAULT_EMBEDDER = os.getenv("DEFAULT_EMBEDDER", "openai-3-large")
+COLLECTION_EMBEDDERS: dict[str, str] = json.loads(os.getenv("COLLECTION_EMBEDDERS", "{}"))
+
+# Query embedding cache: in-memory LRU size and the SQLite file that backs it
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_PATH = CACHE_DIR / "embeddings.sqlite"
+
+# Retrieval result cache: entries also expire when the collection version changes
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "4096"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+
+# Hybrid retrieval: each ranking contributes k * HYBRID_FETCH_FACTOR candidates to the
+# reciprocal rank fusion, whose constant is RRF_K
+HYBRID_FETCH_FACTOR = int(os.getenv("HYBRID_FETCH_FACTOR", "4"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Reranking: "cross-encoder" runs RERANK_MODEL locally (needs sentence-transformers),
+# "embedding" scores cosine similarity with the collection's embedder. Documents
+# scoring below the backend threshold are flagged as not relevant.
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "cross-encoder")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_THRESHOLDS = {"cross-encoder": 0.5, "embedding": 0.3}
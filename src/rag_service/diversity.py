@@ -0,0 +1,108 @@
+import numpy as np
+
+
+def mmr_select(query_embedding: list[float], embeddings: list[list[float]], k: int, lambda_mult: float = 0.5) -> list[int]:
+    """
+    Maximal marginal relevance: greedily pick the candidate that is most similar to
+    the query and least similar to what was already picked. Returns candidate indices.
+    """
+    if not embeddings:
+        return []
+
+    candidates = np.asarray(embeddings, dtype=np.float32)
+    candidates /= np.linalg.norm(candidates, axis=1, keepdims=True).clip(min=1e-12)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query /= max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+
+    selected = [int(np.argmax(relevance))]
+    while len(selected) < min(k, len(candidates)):
+        redundancy = similarity[:, selected].max(axis=1)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+    return selected
+
+
+def _overlap(head: str, tail: str, min_overlap: int, max_overlap: int) -> int:
+    """Length of the longest suffix of `head` that is a prefix of `tail` (0 if < min_overlap)."""
+    probe = tail[:min_overlap]
+    if len(probe) < min_overlap:
+        return 0
+
+    start = max(len(head) - max_overlap, 0)
+    pos = head.find(probe, start)
+    while pos != -1:
+        if tail.startswith(head[pos:]):
+            return len(head) - pos
+        pos = head.find(probe, pos + 1)
+    return 0
+
+
+def collapse_overlaps(documents: list[dict], min_overlap: int = 50, max_overlap: int = 400) -> list[dict]:
+    """
+    Drop duplicate chunks and merge chunks of the same source whose text spans contain or
+    overlap each other (as produced by the splitter's `chunk_overlap`); across sources only
+    exact duplicates are dropped. The merged chunk keeps the position of its best ranked
+    part and lists the ids it absorbed under `merged_ids`.
+    """
+    merged: list[dict] = []
+    for document in documents:
+        document = {**document, "metadata": dict(document.get("metadata") or {})}
+        content = document.get("content") or ""
+        source = document["metadata"].get("source")
+
+        absorbed = False
+        for kept in merged:
+            if kept.get("id") is not None and kept.get("id") == document.get("id"):
+                absorbed = True
+            elif content == kept["content"]:
+                absorbed = True
+            elif kept["metadata"].get("source") == source and source is not None:
+                if content in kept["content"]:
+                    absorbed = True
+                elif kept["content"] in content:
+                    kept["content"] = content
+                    absorbed = True
+                elif overlap := _overlap(kept["content"], content, min_overlap, max_overlap):
+                    kept["content"] = kept["content"] + content[overlap:]
+                    absorbed = True
+                elif overlap := _overlap(content, kept["content"], min_overlap, max_overlap):
+                    kept["content"] = content + kept["content"][overlap:]
+                    absorbed = True
+
+            if absorbed:
+                absorbed_ids = [document.get("id")] + document.get("merged_ids", [])
+                kept_ids = [kept.get("id")] + kept.get("merged_ids", [])
+                new_ids = [doc_id for doc_id in absorbed_ids if doc_id is not None and doc_id not in kept_ids]
+                if new_ids:
+                    kept["merged_ids"] = kept.get("merged_ids", []) + new_ids
+                break
+
+        if not absorbed:
+            merged.append(document)
+
+    # A merge can make two kept chunks overlap each other (A+B then C joins A+B+C)
+    if len(merged) < len(documents):
+        return collapse_overlaps(merged, min_overlap, max_overlap)
+    return merged
+
+
+def collapse_across_queries(results: list[list[dict]], min_overlap: int = 50, max_overlap: int = 400) -> list[list[dict]]:
+    """
+    Apply `collapse_overlaps` over the results of all the queries of a request and
+    keep each surviving chunk only under the first query that retrieved it.
+    """
+    flat = [
+        {**document, "_query": query_idx}
+        for query_idx, documents in enumerate(results)
+        for document in documents
+    ]
+
+    collapsed = collapse_overlaps(flat, min_overlap, max_overlap)
+    grouped: list[list[dict]] = [[] for _ in results]
+    for document in collapsed:
+        grouped[document.pop("_query")].append(document)
+    return grouped
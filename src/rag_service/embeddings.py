@@ -0,0 +1,407 @@
+import asyncio
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from config import (
+    EMBEDDERS,
+    DEFAULT_EMBEDDER,
+    COLLECTION_EMBEDDERS,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_CACHE_PATH,
+    OPENAI_API_KEY,
+)
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace and case so trivially different queries share one cache entry."""
+    return " ".join(unicodedata.normalize("NFC", text).split()).casefold()
+
+
+# --------------------------------------------------------------------------------------
+# Backends
+# --------------------------------------------------------------------------------------
+EMBEDDING_BACKENDS: dict[str, Callable[..., Embeddings]] = {}
+
+
+def register_backend(name: str):
+    """Register an embeddings factory under `name` so it can be referenced from `EMBEDDERS`."""
+    def decorator(factory: Callable[..., Embeddings]) -> Callable[..., Embeddings]:
+        EMBEDDING_BACKENDS[name] = factory
+        return factory
+    return decorator
+
+
+@register_backend("openai")
+def openai_backend(model: str, **kwargs) -> Embeddings:
+    return OpenAIEmbeddings(model=model, api_key=OPENAI_API_KEY, **kwargs)
+
+
+@register_backend("hashing")
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic feature-hashing embedder over words and character trigrams.
+
+    It needs no model and no network, which makes it useful for tests and for
+    benchmarking the retrieval path in isolation. It is not a semantic model.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.model = f"hashing-{dim}"
+
+    def _features(self, text: str) -> list[str]:
+        words = re.findall(r"\w+", normalize_text(text))
+        trigrams = [word[i:i + 3] for word in words for i in range(max(len(word) - 2, 1))]
+        return words + trigrams
+
+    def _embed(self, text: str) -> list[float]:
+        vector = [0.0] * self.dim
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dim] += 1.0 if value >> 63 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent `submit` calls into one call of `fn`.
+
+    Requests are collected until `max_batch_size` texts are queued or `max_wait`
+    seconds have passed since the first one, then `fn` runs once in a worker
+    thread and every caller gets its slice of the result.
+    """
+
+    def __init__(self, fn: Callable[[list[str]], list[list[float]]], max_batch_size: int = 32, max_wait: float = 0.005):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def submit(self, texts: list[str]) -> list[list[float]]:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            try:
+                vectors = await asyncio.to_thread(self.fn, texts)
+            except Exception as exc:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            offset = 0
+            for item_texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+
+@register_backend("local")
+class LocalEmbeddings(Embeddings):
+    """
+    In-process CPU embedder built on `sentence-transformers`.
+
+    Concurrent async requests are micro-batched into a single `encode` call.
+    Models such as nomic or mxbai expect different prefixes for queries and
+    documents, so both can be configured.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        device: str = "cpu",
+        query_prefix: str = "",
+        document_prefix: str = "",
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        **model_kwargs,
+    ):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as exc:
+            raise ImportError(
+                "The 'local' embedding backend requires `sentence-transformers` (pip install sentence-transformers)."
+            ) from exc
+
+        self.model = model
+        self.query_prefix = query_prefix
+        self.document_prefix = document_prefix
+        self.max_batch_size = max_batch_size
+        self._encoder = SentenceTransformer(model, device=device, **model_kwargs)
+        self._batcher = MicroBatcher(self._encode, max_batch_size=max_batch_size, max_wait=max_wait_ms / 1000)
+
+    def _encode(self, texts: list[str]) -> list[list[float]]:
+        return self._encoder.encode(
+            texts,
+            batch_size=self.max_batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+        ).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._encode([self.document_prefix + text for text in texts])
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return self._encode([self.query_prefix + text for text in texts])
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_queries([text])[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self._batcher.submit([self.document_prefix + text for text in texts])
+
+    async def aembed_queries(self, texts: list[str]) -> list[list[float]]:
+        return await self._batcher.submit([self.query_prefix + text for text in texts])
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_queries([text]))[0]
+
+
+# --------------------------------------------------------------------------------------
+# Query embedding cache
+# --------------------------------------------------------------------------------------
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper with a bounded in-memory LRU in front of an SQLite store.
+
+    Query embeddings are keyed by (model name, normalized text), so a restart or
+    another worker pointing to the same file keeps serving repeat queries for
+    free. Document embeddings (ingestion) are passed through uncached.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        max_items: int = 10_000,
+        db_path: Path | None = None,
+    ):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_items = max_items
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        if db_path is not None:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._db.commit()
+
+    # ----------------------------------------------------------------------------------
+    # Cache tiers
+    # ----------------------------------------------------------------------------------
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> list[float] | None:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector
+
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = array("f", row[0]).tolist()
+                    self._remember(key, vector)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def _remember(self, key: str, vector: list[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _store(self, items: dict[str, list[float]]) -> None:
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, array("f", vector).tobytes()) for key, vector in items.items()],
+                )
+                self._db.commit()
+
+    def _split(self, texts: list[str]) -> tuple[list[str], list[list[float] | None], dict[str, str]]:
+        """Return keys, cached vectors (None on miss) and the unique missing texts by key."""
+        keys = [self._key(text) for text in texts]
+        vectors = [self._lookup(key) for key in keys]
+        missing = {key: text for key, text, vector in zip(keys, texts, vectors) if vector is None}
+        return keys, vectors, missing
+
+    @staticmethod
+    def _merge(keys: list[str], vectors: list[list[float] | None], computed: dict[str, list[float]]) -> list[list[float]]:
+        return [vector if vector is not None else computed[key] for key, vector in zip(keys, vectors)]
+
+    # ----------------------------------------------------------------------------------
+    # Embeddings interface
+    # ----------------------------------------------------------------------------------
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Embed several queries at once; only the cache misses reach the backend."""
+        keys, vectors, missing = self._split(texts)
+        computed: dict[str, list[float]] = {}
+        if missing:
+            embed = getattr(self.embeddings, "embed_queries", self.embeddings.embed_documents)
+            computed = dict(zip(missing, embed(list(missing.values()))))
+            self._store(computed)
+        return self._merge(keys, vectors, computed)
+
+    async def _run(self, fn, *args):
+        """Run a cache call off the event loop when it touches the SQLite store."""
+        return fn(*args) if self._db is None else await asyncio.to_thread(fn, *args)
+
+    async def aembed_queries(self, texts: list[str]) -> list[list[float]]:
+        keys, vectors, missing = await self._run(self._split, texts)
+        computed: dict[str, list[float]] = {}
+        if missing:
+            embed = getattr(self.embeddings, "aembed_queries", self.embeddings.aembed_documents)
+            computed = dict(zip(missing, await embed(list(missing.values()))))
+            await self._run(self._store, computed)
+        return self._merge(keys, vectors, computed)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_queries([text])[0]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_queries([text]))[0]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+
+# --------------------------------------------------------------------------------------
+# Per-collection embedders
+# --------------------------------------------------------------------------------------
+_embedders: dict[str, Embeddings] = {}
+_embedders_lock = threading.Lock()
+
+
+def build_embeddings(name: str) -> Embeddings:
+    """Instantiate the embedder configured under `name` in `EMBEDDERS`."""
+    if name not in EMBEDDERS:
+        raise KeyError(f"Unknown embedder '{name}'. Available embedders: {list(EMBEDDERS)}")
+
+    spec = dict(EMBEDDERS[name])
+    backend = spec.pop("backend")
+    cache = spec.pop("cache", True)
+    if backend not in EMBEDDING_BACKENDS:
+        raise KeyError(f"Unknown embedding backend '{backend}'. Available backends: {list(EMBEDDING_BACKENDS)}")
+
+    embeddings = EMBEDDING_BACKENDS[backend](**spec)
+    if not cache:
+        return embeddings
+    # The whole spec goes into the cache key: a new query_prefix or dimension changes the vectors
+    digest = hashlib.sha1(json.dumps({"backend": backend, **spec}, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return CachedEmbeddings(
+        embeddings,
+        model_name=f"{backend}:{spec.get('model', name)}@{digest}",
+        max_items=EMBEDDING_CACHE_SIZE,
+        db_path=EMBEDDING_CACHE_PATH,
+    )
+
+
+def get_embedder(name: str) -> Embeddings:
+    """Return the shared instance of the embedder configured under `name`."""
+    with _embedders_lock:
+        if name not in _embedders:
+            _embedders[name] = build_embeddings(name)
+        return _embedders[name]
+
+
+def get_embeddings(collection_name: str) -> Embeddings:
+    """Return the embedder configured for a collection (or the default one)."""
+    return get_embedder(COLLECTION_EMBEDDERS.get(collection_name, DEFAULT_EMBEDDER))
+
+
+async def aembed_queries(embeddings: Embeddings, queries: list[str]) -> list[list[float]]:
+    """Embed a batch of queries with whatever batching entry point the embedder offers."""
+    if hasattr(embeddings, "aembed_queries"):
+        return await embeddings.aembed_queries(queries)
+    return await embeddings.aembed_documents(queries)
+
+
+def embedder_stats() -> dict:
+    with _embedders_lock:
+        return {
+            name: embeddings.stats()
+            for name, embeddings in _embedders.items()
+            if isinstance(embeddings, CachedEmbeddings)
+        }
@@ -0,0 +1,478 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+
+from config import DATA_DIR, EXCEL_CACHE_DIR, EXCEL_ENGINE, EXCEL_WORKERS, SQL_QUERY_CLASSES, DEFAULT_SQL_QUERY_CLASS
+
+EXCEL_SUFFIXES = {".xlsx", ".xls", ".xlsm"}
+# Files DuckDB scans in place, with projection and filter pushdown, and the function that reads them
+SCAN_FUNCTIONS = {".parquet": "read_parquet", ".csv": "read_csv", ".tsv": "read_csv"}
+# Arrow IPC files are rewritten once to Parquet, which DuckDB scans natively
+ARROW_SUFFIXES = {".arrow", ".feather", ".ipc"}
+# Query class limits that are DuckDB instance settings
+INSTANCE_SETTINGS = ("memory_limit", "threads")
+
+
+def table_name(file_path: Path) -> str:
+    """Sanitise a file name into a table name: "Financial Sample.xlsx" ➜ "financial_sample"."""
+    return sanitise_name(file_path.stem)
+
+
+def sanitise_name(name: str) -> str:
+    return re.sub(r"\W+", "_", name).strip("_").lower()
+
+
+def sheet_tables(name: str, sheets: list[str]) -> list[str]:
+    """Table names of a workbook's sheets: the first sheet keeps the workbook's name, the others are suffixed with theirs."""
+    return [name] + [f"{name}_{sanitise_name(sheet)}" for sheet in sheets[1:]]
+
+
+def sql_string(value: str | Path) -> str:
+    """Quote a value as a SQL string literal."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def sql_identifier(name: str) -> str:
+    """Quote a name as a SQL identifier."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def file_hash(file_path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@lru_cache
+def resolve_engine(engine: str | None) -> str | None:
+    """Return the Excel engine to use, falling back to the pandas default if it isn't installed."""
+    if engine == "calamine":
+        try:
+            import python_calamine  # noqa: F401
+        except ImportError:
+            print("[WARN] python-calamine is not installed, reading workbooks with openpyxl (pip install python-calamine).")
+            return None
+    return engine
+
+
+def convert_workbook(file_path: str, db_path: str, name: str, engine: str | None) -> list[str]:
+    """
+    Load every sheet of a workbook into a DuckDB file, one native, ANALYZEd table per
+    non-empty sheet; returns the table names. Runs in a worker process.
+    """
+    sheets = pd.read_excel(file_path, sheet_name=None, engine=engine)
+    tmp_path = db_path + ".tmp"
+    Path(tmp_path).unlink(missing_ok=True)
+
+    con = duckdb.connect(tmp_path)
+    tables = []
+    for table, df in zip(sheet_tables(name, list(sheets)), sheets.values()):
+        if df.columns.empty:
+            continue
+        con.register("sheet", df)
+        con.execute(f"CREATE TABLE {sql_identifier(table)} AS SELECT * FROM sheet")
+        con.unregister("sheet")
+        tables.append(table)
+    con.execute("ANALYZE")
+    con.execute("CHECKPOINT")
+    con.close()
+    os.replace(tmp_path, db_path)
+    return tables
+
+
+def convert_arrow(file_path: str, parquet_path: str) -> None:
+    """Rewrite an Arrow IPC file (file or stream format) to Parquet, one record batch at a time."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    source = pa.memory_map(file_path)
+    try:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        source.seek(0)
+        reader = pa.ipc.open_stream(source)
+        batches = iter(reader)
+
+    tmp_path = parquet_path + ".tmp"
+    with pq.ParquetWriter(tmp_path, reader.schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    os.replace(tmp_path, parquet_path)
+
+
+@contextmanager
+def exclusive_lock(lock_path: Path):
+    """Inter-process lock so only one worker at a time converts workbooks and builds their table files."""
+    with open(lock_path, "w") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+class ExcelCatalog:
+    """
+    The data files of the data directory as DuckDB tables.
+
+    Parquet and CSV files are exposed as views over DuckDB's own scan of the file, so
+    queries read them in place with projection and filter pushdown. Arrow IPC files are
+    rewritten once to Parquet and scanned the same way. Each Excel workbook is loaded
+    once into its own DuckDB file, one native, ANALYZEd table per sheet. Converted files
+    are keyed by their source's content hash, and every worker process attaches the
+    workbook files read-only, so tables are paged in from disk on demand instead of
+    being copied into each worker. `load` can run again at any time: only added or
+    changed files are ingested, and their views are swapped to the new version in one
+    statement so in-flight queries finish on the version they started with.
+
+    Every query class gets a DuckDB instance of its own, configured with the class's
+    memory and thread limits, and all of them share the same views and table files.
+    """
+
+    def __init__(
+        self,
+        data_dir: Path,
+        cache_dir: Path,
+        engine: str | None = "calamine",
+        workers: int = 1,
+        query_classes: dict[str, dict] | None = None,
+        default_class: str | None = None,
+    ):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.engine = engine
+        self.workers = max(workers, 1)
+
+        query_classes = query_classes or {"default": {}}
+        self.dbs: dict[str, duckdb.DuckDBPyConnection] = {
+            name: duckdb.connect(
+                database=":memory:",
+                config={key: limits[key] for key in INSTANCE_SETTINGS if limits.get(key) is not None},
+            )
+            for name, limits in query_classes.items()
+        }
+        self.db = self.dbs[default_class or next(iter(self.dbs))]
+        # table_name -> metadata (file path, format, content hash, version, schema)
+        self.tables: dict[str, dict] = {}
+
+        self._versions: dict[str, int] = {}  # last version per table name, kept across removals
+        self._retired: set[str] = set()  # aliases of replaced workbook files, detached on the next load
+        self._load_lock = threading.Lock()
+        self._refresh_lock = asyncio.Lock()
+        self._manifest_path = cache_dir / "manifest.json"
+
+    # ----------------------------------------------------------------------------------
+    # Ingest
+    # ----------------------------------------------------------------------------------
+    def _read_manifest(self) -> dict:
+        try:
+            return json.loads(self._manifest_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _hash(self, file_path: Path, manifest: dict) -> str:
+        """Content hash of a file, reused from the manifest while its size and mtime are unchanged."""
+        stat = file_path.stat()
+        entry = manifest.get(file_path.name)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["hash"]
+
+        digest = file_hash(file_path)
+        tables = entry.get("tables") if entry and entry["hash"] == digest else None
+        manifest[file_path.name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest}
+        if tables is not None:
+            manifest[file_path.name]["tables"] = tables
+        return digest
+
+    def _convert(self, jobs: dict[Path, tuple]) -> tuple[dict[Path, object], dict[Path, Exception]]:
+        """Run the conversions (function, *args) per file, in parallel processes when there are several."""
+        results: dict[Path, object] = {}
+        errors: dict[Path, Exception] = {}
+        if len(jobs) == 1 or self.workers == 1:
+            for file_path, (fn, *args) in jobs.items():
+                try:
+                    results[file_path] = fn(*args)
+                except Exception as exc:
+                    errors[file_path] = exc
+            return results, errors
+
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(jobs))) as pool:
+            futures = {file_path: pool.submit(fn, *args) for file_path, (fn, *args) in jobs.items()}
+            for file_path, future in futures.items():
+                try:
+                    results[file_path] = future.result()
+                except Exception as exc:
+                    errors[file_path] = exc
+        return results, errors
+
+    def _keep_previous(self, source: dict, entry: dict | None) -> bool:
+        """Point the source back at the converted file of its previous version, if that is still cached."""
+        if entry is None or entry["hash"] == source["hash"]:
+            return False
+        name = source["name"]
+        if source["format"] == "excel":
+            db_path = self.cache_dir / f"{name}-{entry['hash']}.duckdb"
+            if not db_path.exists() or "tables" not in entry:
+                return False
+            source.update(hash=entry["hash"], db_path=str(db_path))
+        else:
+            parquet_path = self.cache_dir / f"{name}-{entry['hash']}.parquet"
+            if not parquet_path.exists():
+                return False
+            source.update(hash=entry["hash"], parquet_path=str(parquet_path))
+        return True
+
+    def _ingest(self) -> dict[str, dict]:
+        """Bring the converted files in line with the data directory (one worker at a time); returns the tables."""
+        with exclusive_lock(self.cache_dir / ".lock"):
+            manifest = self._read_manifest()
+            previous = {file_name: dict(entry) for file_name, entry in manifest.items()}
+            files: dict[Path, dict] = {}
+            jobs: dict[Path, tuple] = {}
+            for file_path in sorted(self.data_dir.iterdir()):
+                suffix = file_path.suffix.lower()
+                if not file_path.is_file() or suffix not in EXCEL_SUFFIXES | ARROW_SUFFIXES | SCAN_FUNCTIONS.keys():
+                    continue
+                name = table_name(file_path)
+                stat = file_path.stat()
+                digest = self._hash(file_path, manifest)
+                source = files[file_path] = {
+                    "name": name, "file_path": str(file_path), "hash": digest, "stat": [stat.st_size, stat.st_mtime_ns],
+                }
+
+                if suffix in EXCEL_SUFFIXES:
+                    source.update(format="excel", db_path=str(self.cache_dir / f"{name}-{digest}.duckdb"))
+                    if not Path(source["db_path"]).exists() or "tables" not in manifest[file_path.name]:
+                        jobs[file_path] = (convert_workbook, str(file_path), source["db_path"], name, resolve_engine(self.engine))
+                elif suffix in ARROW_SUFFIXES:
+                    source.update(format="arrow", parquet_path=str(self.cache_dir / f"{name}-{digest}.parquet"))
+                    if not Path(source["parquet_path"]).exists():
+                        jobs[file_path] = (convert_arrow, str(file_path), source["parquet_path"])
+                else:
+                    source.update(format=suffix.lstrip("."))
+
+            results, errors = self._convert(jobs) if jobs else ({}, {})
+            for file_path, exc in list(errors.items()):
+                print(f"[WARN] Could not read {file_path.name}: {exc}")
+                # A file replaced by one that can't be read (or is still being copied) keeps its last conversion
+                if self._keep_previous(files[file_path], previous.get(file_path.name)):
+                    manifest[file_path.name] = previous[file_path.name]
+                    del errors[file_path]
+            for file_path, tables in results.items():
+                if files[file_path]["format"] == "excel":
+                    manifest[file_path.name]["tables"] = tables
+
+            sources: dict[str, dict] = {}
+            for file_path, source in files.items():
+                if file_path in errors:
+                    continue
+                if source["format"] == "excel":
+                    alias = f"{source['name']}_{source['hash'][:12]}"
+                    names = manifest[file_path.name]["tables"]
+                    relations = [(table, f"{sql_identifier(alias)}.{sql_identifier(table)}") for table in names]
+                elif source["format"] == "arrow":
+                    alias = None
+                    relations = [(source["name"], f"read_parquet({sql_string(Path(source['parquet_path']).resolve())})")]
+                else:
+                    alias = None
+                    scan = SCAN_FUNCTIONS[file_path.suffix.lower()]
+                    relations = [(source["name"], f"{scan}({sql_string(file_path.resolve())})")]
+
+                for table, relation in relations:
+                    if table in sources:
+                        print(f"[WARN] Skipping table '{table}' of {file_path.name}: {sources[table]['file_path']} already defines it.")
+                        continue
+                    sources[table] = {
+                        "table_name": table,
+                        "file_path": source["file_path"],
+                        "format": source["format"],
+                        "hash": source["hash"],
+                        "stat": source["stat"],
+                        "db_path": source.get("db_path"),
+                        "alias": alias,
+                        "relation": relation,
+                    }
+
+            if sources:
+                # Drop the converted files of sources that changed or disappeared; workers that
+                # still have an old workbook file attached keep reading their open copy
+                live = {
+                    Path(source[key]).name
+                    for source in files.values()
+                    for key in ("db_path", "parquet_path")
+                    if key in source
+                }
+                for path in [*self.cache_dir.glob("*.parquet"), *self.cache_dir.glob("*.duckdb")]:
+                    if path.name not in live:
+                        path.unlink(missing_ok=True)
+                self._manifest_path.write_text(json.dumps(manifest, indent=2))
+        return sources
+
+    @staticmethod
+    def _swap_view(cursors: list[duckdb.DuckDBPyConnection], name: str, source: dict, current: dict | None) -> list[tuple]:
+        """
+        Point the table's view at the source on every DuckDB instance and return its description.
+        The source is read before any view changes, and if a swap fails the instances already
+        swapped get their previous view back, so all of them keep showing the same version.
+        """
+        for cursor in cursors:
+            if source["alias"] is not None:
+                cursor.execute(f'ATTACH IF NOT EXISTS {sql_string(source["db_path"])} AS "{source["alias"]}" (READ_ONLY)')
+        description = cursors[0].execute(f'DESCRIBE SELECT * FROM {source["relation"]}').fetchall()
+
+        swapped = []
+        try:
+            for cursor in cursors:
+                cursor.execute(f'CREATE OR REPLACE VIEW {sql_identifier(name)} AS SELECT * FROM {source["relation"]}')
+                swapped.append(cursor)
+        except duckdb.Error:
+            for cursor in swapped:
+                try:
+                    if current is not None:
+                        cursor.execute(f'CREATE OR REPLACE VIEW {sql_identifier(name)} AS SELECT * FROM {current["relation"]}')
+                    else:
+                        cursor.execute(f'DROP VIEW IF EXISTS {sql_identifier(name)}')
+                except duckdb.Error as exc:
+                    print(f"[WARN] Could not restore the view of table '{name}': {exc}")
+            raise
+        return description
+
+    def load(self) -> dict[str, list[str]]:
+        """
+        Ingest new or changed data files and swap their views to the new version.
+        Unchanged tables keep their version; changed ones get the next version.
+        """
+        if not self.data_dir.exists():
+            raise FileNotFoundError(f"DATA_DIR '{self.data_dir}' does not exist – create it and add data files.")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        with self._load_lock:
+            sources = self._ingest()
+            if not sources:
+                raise RuntimeError(f"No tables were successfully loaded from '{self.data_dir}/'.")
+
+            # DDL runs on its own cursors so queries on the shared connections are never blocked
+            cursors = [db.cursor() for db in self.dbs.values()]
+            retired, changes = set(), {"added": [], "updated": [], "removed": []}
+            tables = {}
+            for name, source in sources.items():
+                current = self.tables.get(name)
+                if current is not None and current["hash"] == source["hash"] and current["relation"] == source["relation"]:
+                    tables[name] = {**current, "stat": source["stat"]}
+                    continue
+
+                try:
+                    description = self._swap_view(cursors, name, source, current)
+                except duckdb.Error as exc:
+                    print(f"[WARN] Could not load table '{name}' from {Path(source['file_path']).name}: {exc}")
+                    if source["alias"] is not None and (current is None or current["alias"] != source["alias"]):
+                        retired.add(source["alias"])
+                    if current is not None:
+                        tables[name] = {**current, "stat": source["stat"]}  # keeps the version it had until the file changes again
+                    continue
+                tables[name] = {
+                    **source,
+                    "version": self._versions.get(name, 0) + 1,
+                    "schema": {col: dtype for col, dtype, *_ in description},
+                }
+                self._versions[name] = tables[name]["version"]
+                changes["updated" if current is not None else "added"].append(name)
+                if current is not None and current["alias"] is not None:
+                    retired.add(current["alias"])
+
+            if not tables:
+                raise RuntimeError(f"No tables were successfully loaded from '{self.data_dir}/'.")
+
+            for name, current in self.tables.items():
+                if name not in tables:
+                    for cursor in cursors:
+                        cursor.execute(f'DROP VIEW IF EXISTS {sql_identifier(name)}')
+                    if current["alias"] is not None:
+                        retired.add(current["alias"])
+                    changes["removed"].append(name)
+
+            self.tables = tables
+
+            # Files replaced by the previous load have had a full load cycle to drain
+            live = {table["alias"] for table in tables.values()}
+            for cursor in cursors:
+                for alias in self._retired - live:
+                    cursor.execute(f'DETACH DATABASE IF EXISTS "{alias}"')
+                cursor.close()
+            self._retired = retired - live
+        return changes
+
+    def stale(self) -> list[str]:
+        """
+        Tables scanned in place (Parquet, CSV) whose file changed since it was loaded. Their
+        views already read the new rows, so results cached or derived under the old version
+        (result cache, rollups, samples, profiles, value dictionaries) no longer match them.
+        """
+        stale = []
+        for name, table in self.tables.items():
+            if Path(table["file_path"]).suffix.lower() not in SCAN_FUNCTIONS:
+                continue
+            try:
+                stat = os.stat(table["file_path"])
+                current = [stat.st_size, stat.st_mtime_ns]
+            except OSError:
+                current = None
+            if current != table["stat"]:
+                stale.append(name)
+        return stale
+
+    async def refresh_stale(self) -> dict[str, list[str]] | None:
+        """Reload if a file scanned in place changed, so its table gets the next version; returns the changes."""
+        if not self.stale():
+            return None
+        async with self._refresh_lock:
+            if not self.stale():  # a concurrent request reloaded it
+                return None
+            return await asyncio.to_thread(self.load)
+
+    def referenced_tables(self, sql: str) -> list[str]:
+        """Known table names that appear as identifiers in the SQL."""
+        return [name for name in self.tables if re.search(rf"\b{re.escape(name)}\b", sql, re.IGNORECASE)]
+
+    # ----------------------------------------------------------------------------------
+    # Hot reload
+    # ----------------------------------------------------------------------------------
+    def start_watcher(self) -> asyncio.Task:
+        """Reload whenever files in the data directory change."""
+        try:
+            from watchfiles import awatch
+        except ImportError as exc:
+            raise ImportError("EXCEL_WATCH requires `watchfiles` (pip install watchfiles).") from exc
+
+        async def watch():
+            async for _ in awatch(self.data_dir):
+                try:
+                    await asyncio.to_thread(self.load)
+                except Exception as exc:
+                    print(f"[WARN] Could not reload '{self.data_dir}': {exc}")
+
+        return asyncio.create_task(watch())
+
+
+excel_tables = ExcelCatalog(
+    DATA_DIR,
+    EXCEL_CACHE_DIR,
+    engine=EXCEL_ENGINE,
+    workers=EXCEL_WORKERS,
+    query_classes=SQL_QUERY_CLASSES,
+    default_class=DEFAULT_SQL_QUERY_CLASS,
+)
@@ -0,0 +1,177 @@
+import asyncio
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from chromadb.api.models.Collection import Collection
+
+
+_TOKEN_RE = re.compile(r"\w+(?:[-_/.]\w+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lower-case, accent-insensitive word tokens. Compound tokens such as policy
+    codes ("HR-104") are kept whole and also split into their parts.
+    """
+    text = unicodedata.normalize("NFD", text.casefold())
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-_/.]", token) if part)
+    return tokens
+
+
+class BM25Index:
+    """
+    In-process inverted index with Okapi BM25 scoring over one Chroma collection.
+
+    The index mirrors the collection by id: `sync` only fetches the documents
+    that were added since the last sync and drops the ones that disappeared.
+    Ids can't tell a chunk re-upserted with new text, so a new collection id or
+    `version` metadata key (see `ChromaPool.version`) rebuilds the index instead.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.version: tuple | None = None
+
+        self._postings: dict[str, dict[str, int]] = {}
+        self._doc_terms: dict[str, Counter] = {}
+        self._doc_lengths: dict[str, int] = {}
+        self._documents: dict[str, dict] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    # ----------------------------------------------------------------------------------
+    # Maintenance
+    # ----------------------------------------------------------------------------------
+    def _add(self, doc_id: str, content: str, metadata: dict | None) -> None:
+        terms = Counter(tokenize(content))
+        self._doc_terms[doc_id] = terms
+        self._doc_lengths[doc_id] = sum(terms.values())
+        self._documents[doc_id] = {"id": doc_id, "content": content, "metadata": metadata or {}}
+        self._total_length += self._doc_lengths[doc_id]
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+
+    def _remove(self, doc_id: str) -> None:
+        for term in self._doc_terms.pop(doc_id, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id, 0)
+        self._documents.pop(doc_id, None)
+
+    def add(self, doc_id: str, content: str, metadata: dict | None = None) -> None:
+        """Index a single document, replacing any with the same id (for indexes not backed by a collection)."""
+        with self._lock:
+            self._remove(doc_id)
+            self._add(doc_id, content, metadata)
+
+    def _clear(self) -> None:
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_lengths.clear()
+        self._documents.clear()
+        self._total_length = 0
+
+    def sync(self, collection: Collection, version: tuple | None = None, page_size: int = 500) -> None:
+        """Bring the index in line with the collection contents."""
+        ids = set(collection.get(include=[])["ids"])
+        with self._lock:
+            # Same collection and ingestion version: only ids were added or deleted since
+            if self.version is None or version is None or (self.version[0], self.version[2]) != (version[0], version[2]):
+                self._clear()
+            removed = [doc_id for doc_id in self._doc_lengths if doc_id not in ids]
+            added = [doc_id for doc_id in ids if doc_id not in self._doc_lengths]
+            for doc_id in removed:
+                self._remove(doc_id)
+
+        for start in range(0, len(added), page_size):
+            page = collection.get(ids=added[start:start + page_size], include=["documents", "metadatas"])
+            with self._lock:
+                for doc_id, content, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                    self._add(doc_id, content or "", metadata)
+
+        self.version = version
+
+    # ----------------------------------------------------------------------------------
+    # Search
+    # ----------------------------------------------------------------------------------
+    def search(self, query: str, k: int, allowed_ids: set[str] | None = None) -> list[dict]:
+        """Return the top-k documents by BM25 score, each with its `bm25_score`."""
+        with self._lock:
+            n_docs = len(self._doc_lengths)
+            if not n_docs:
+                return []
+            avg_length = self._total_length / n_docs
+
+            scores: dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    if allowed_ids is not None and doc_id not in allowed_ids:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [{**self._documents[doc_id], "bm25_score": score} for doc_id, score in top]
+
+
+class BM25Registry:
+    """One lazily built `BM25Index` per collection, re-synced when its version changes."""
+
+    def __init__(self):
+        self._indexes: dict[str, BM25Index] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    async def get(self, collection_name: str, collection: Collection, version: tuple | None) -> BM25Index:
+        index = self._indexes.setdefault(collection_name, BM25Index())
+        if index.version is not None and index.version == version:
+            return index
+
+        lock = self._locks.setdefault(collection_name, asyncio.Lock())
+        async with lock:
+            if index.version is None or index.version != version:
+                await asyncio.to_thread(index.sync, collection, version)
+        return index
+
+    def drop(self, collection_name: str) -> None:
+        self._indexes.pop(collection_name, None)
+
+
+def reciprocal_rank_fusion(rankings: list[list[dict]], k: int, rrf_k: int = 60) -> list[dict]:
+    """
+    Fuse several ranked document lists by id with RRF: score = sum(1 / (rrf_k + rank)).
+    The fused documents keep the per-ranking scores and gain an `rrf_score`.
+    """
+    fused: dict[str, float] = {}
+    documents: dict[str, dict] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            doc_id = document["id"]
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+            documents[doc_id] = {**documents.get(doc_id, {}), **document}
+
+    top = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [{**documents[doc_id], "rrf_score": score} for doc_id, score in top]
+
+
+bm25_indexes = BM25Registry()
@@ -1,77 +1,474 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+from contextlib import asynccontextmanager
 
-import chromadb
-from langchain_chroma import Chroma
-from langchain.schema import Document
+import duckdb
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse
 
-from config import RAG_HOST, RAG_PORT, settings, embeddings_model
-from config import TABLES, db
-from schemas import Query, ExcelSQLQuery
+from approx import table_samples
+from config import (
+    DEFAULT_EMBEDDER,
+    DEFAULT_SQL_QUERY_CLASS,
+    EXCEL_WATCH,
+    RERANK_THRESHOLDS,
+    SQL_DISCONNECT_POLL,
+    SQL_QUERY_CLASSES,
+)
+from embeddings import get_embeddings, get_embedder, embedder_stats
+from excel_store import excel_tables
+from profiles import table_profiles
+from rerank import get_reranker
+from rollups import sql_rollups
+from retrieval import search, search_iter
+from scratch import scratch_sessions
+from schema_index import schema_index
+from schemas import Query, BatchQuery, RerankRequest, ExcelSQLQuery, SchemaSearch, ValueResolve
+from sql_guard import QueryRejected, execute_guarded, limit_sql
+from sql_results import (
+    ResultCursor,
+    arrow_stream,
+    as_async,
+    collect_records,
+    fetch_all,
+    iter_batches,
+    ndjson_rows,
+    read_ahead,
+    sql_cache,
+    sql_cursors,
+    sql_executor,
+    take_rows,
+)
+from value_index import value_dictionaries
+from vectorstore import chroma_pool, result_cache
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the Excel catalog and open the long-lived Chroma client on startup, release them on shutdown."""
+    await asyncio.to_thread(excel_tables.load)
+    profiling = asyncio.create_task(table_profiles.warm())
+    indexing = asyncio.create_task(value_dictionaries.warm())
+    sql_rollups.schedule_refresh()
+    table_samples.schedule_refresh()
+    scratch_sessions.start()
+    watcher = excel_tables.start_watcher() if EXCEL_WATCH else None
+    chroma_pool.start()
+    yield
+    chroma_pool.close()
+    profiling.cancel()
+    indexing.cancel()
+    sql_rollups.close()
+    table_samples.close()
+    scratch_sessions.close()
+    sql_executor.shutdown()
+    if watcher is not None:
+        watcher.cancel()
 
 
 # Initialize FastAPI server
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 # --------------------------------------------------------------------------------------
 # RAG APIs
 # --------------------------------------------------------------------------------------
+def _wants_ndjson(accept: str | None) -> bool:
+    return accept is not None and NDJSON_MEDIA_TYPE in accept
+
+
+def _ndjson(obj: dict) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
 @app.post("/retrieve/{collection_name}")
-async def retrieve(request: Query, collection_name: str):
-    """Retrieve documents from the specified collection using the provided query and k value."""
-    client = chromadb.HttpClient(
-        host=RAG_HOST,
-        port=int(RAG_PORT),
-        settings=settings
-    )
-    vectordb = Chroma(
-        client=client,
-        collection_name=collection_name,
-        embedding_function=embeddings_model,
-    )
-    
-    retriever = vectordb.as_retriever(search_kwargs={"k": request.k})
-    docs: list[Document] = await retriever.ainvoke(request.query)
-    if not docs:
+async def retrieve(request: Query, collection_name: str, accept: str | None = Header(None)):
+    """
+    Retrieve documents from the specified collection using the provided query and k value.
+    With `Accept: application/x-ndjson` every document is streamed as its own line. The lines
+    only start once the whole ranking is known: a query's documents come out of one Chroma
+    query (and MMR, fusion or dedup over all of them), so the first one is no earlier than the last.
+    """
+    [documents] = await search(collection_name, [request.query], request)
+    if not documents:
         raise HTTPException(status_code=404, detail="No documents found")
+    
+    if _wants_ndjson(accept):
+        def event_stream():
+            for rank, document in enumerate(documents, start=1):
+                yield _ndjson({"type": "document", "rank": rank, "document": document})
+            yield _ndjson({"type": "end", "query": request.query, "k": request.k, "count": len(documents)})
+        
+        return StreamingResponse(event_stream(), media_type=NDJSON_MEDIA_TYPE)
+    
     return {
         "query": request.query,
         "k": request.k,
-        "documents": [
-            {"content": d.page_content, "metadata": d.metadata} for d in docs
-        ],
+        "documents": documents,
+    }
+
+
+@app.post("/retrieve/{collection_name}/batch")
+async def retrieve_batch(request: BatchQuery, collection_name: str, accept: str | None = Header(None)):
+    """
+    Retrieve documents for several queries at once, returning one result list per query.
+    With `Accept: application/x-ndjson` each query's group is streamed as soon as it
+    completes (cached ones first); with `dedup` the groups are sent once all are done.
+    """
+    if not _wants_ndjson(accept):
+        results = await search(collection_name, request.queries, request)
+        if not any(results):
+            raise HTTPException(status_code=404, detail="No documents found")
+        return {
+            "k": request.k,
+            "results": [
+                {"query": query, "documents": documents}
+                for query, documents in zip(request.queries, results)
+            ],
+        }
+    
+    async def completed():
+        if request.dedup:
+            for idx, documents in enumerate(await search(collection_name, request.queries, request)):
+                yield idx, documents
+        else:
+            async for idx, documents in search_iter(collection_name, request.queries, request, split=True):
+                yield idx, documents
+    
+    async def event_stream():
+        count = 0
+        async for idx, documents in completed():
+            count += len(documents)
+            yield _ndjson({"type": "result", "index": idx, "query": request.queries[idx], "documents": documents})
+        yield _ndjson({"type": "end", "k": request.k, "count": count})
+    
+    return StreamingResponse(event_stream(), media_type=NDJSON_MEDIA_TYPE)
+
+
+@app.post("/rerank")
+async def rerank(request: RerankRequest):
+    """Score (query, document) pairs with a local reranker and flag the relevant documents."""
+    if not request.documents:
+        return {"backend": None, "threshold": request.threshold, "scores": [], "ranking": [], "relevant": []}
+    
+    reranker = await asyncio.to_thread(get_reranker)
+    embeddings = get_embeddings(request.collection_name) if request.collection_name else get_embedder(DEFAULT_EMBEDDER)
+    scores = await reranker.score(request.query, request.documents, embeddings)
+    
+    threshold = request.threshold if request.threshold is not None else RERANK_THRESHOLDS[reranker.name]
+    ranking = sorted(range(len(scores)), key=lambda idx: scores[idx], reverse=True)
+    keep = set(ranking[:request.min_keep]) | {idx for idx, score in enumerate(scores) if score >= threshold}
+    return {
+        "backend": reranker.name,
+        "threshold": threshold,
+        "scores": scores,
+        "ranking": ranking,
+        "relevant": [idx in keep for idx in range(len(scores))],
+    }
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Report hit/miss counters of the service caches."""
+    return {
+        "embeddings": embedder_stats(),
+        "results": result_cache.stats(),
+        "sql": sql_cache.stats(),
+        "profiles": table_profiles.stats(),
+        "rollups": sql_rollups.stats(),
+        "samples": table_samples.stats(),
+        "scratch": scratch_sessions.stats(),
+        "values": value_dictionaries.stats(),
     }
 
 
 # --------------------------------------------------------------------------------------
 # Excel db APIs
 # --------------------------------------------------------------------------------------
+def _refresh_derived() -> None:
+    """Rebuild what is derived from the tables after a load; each keeps its old version meanwhile."""
+    asyncio.create_task(table_profiles.warm())
+    asyncio.create_task(value_dictionaries.warm())
+    sql_rollups.schedule_refresh()
+    table_samples.schedule_refresh()
+
+
+async def _refresh_tables() -> None:
+    """Reload files scanned in place that changed, so no cached or derived result outlives them."""
+    try:
+        changes = await excel_tables.refresh_stale()
+    except (FileNotFoundError, RuntimeError) as exc:
+        print(f"[WARN] Could not reload changed data files: {exc}")
+        return
+    if changes is not None:
+        _refresh_derived()
+
+
+async def _require_table(table: str) -> None:
+    await _refresh_tables()
+    if table not in excel_tables.tables:
+        raise HTTPException(status_code=404, detail=f"Table '{table}' not found. Available tables: {list(excel_tables.tables)}")
+
+
+async def _until_disconnected(request: Request, awaitable):
+    """Await the work, cancelling it (and so interrupting its query) once the client goes away."""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=SQL_DISCONNECT_POLL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.wait({task})
+
+
 @app.get("/excel/{table}/schema")
 async def get_schema(table: str):
     """Return column names and DuckDB types so the agent can reason about them."""
     
-    description = db.execute(f"DESCRIBE {table}").fetchall()
+    await _require_table(table)
+    description = await fetch_all(excel_tables.db, f'DESCRIBE "{table}"')
     return [
         {"column": col, "type": dtype}
         for col, dtype, *_ in description
     ]
 
 
+@app.post("/excel/schema/search")
+async def search_schema(body: SchemaSearch):
+    """
+    Return only the tables and columns relevant to a question, ranked by BM25 over column
+    names, descriptions and profiled values, so SQL prompts carry a fraction of the schema.
+    """
+    
+    await _refresh_tables()
+    if body.tables is not None:
+        for table in body.tables:
+            await _require_table(table)
+    return {
+        "question": body.question,
+        "tables": await schema_index.search(body.question, body.k, body.max_tables, body.tables),
+    }
+
+
+@app.get("/excel/{table}/profile")
+async def get_profile(table: str):
+    """
+    Return per-column statistics (min/max, null count, approximate distinct count, most
+    frequent values of categorical columns) and sample rows, cached per table version.
+    """
+    
+    await _require_table(table)
+    return await table_profiles.get(table)
+
+
+@app.post("/excel/{table}/values/resolve")
+async def resolve_values(body: ValueResolve, table: str):
+    """
+    Map filter values as a user wrote them ("canada", "channel partner", "Cote d'Ivoire") to
+    the stored values of the table's text columns, tolerating case, accents, plurals and typos.
+    """
+    
+    await _require_table(table)
+    unknown = [column for column in body.columns or [] if column not in excel_tables.tables[table]["schema"]]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Columns {unknown} not found in table '{table}'.")
+    return {
+        "table": table,
+        "results": await value_dictionaries.resolve(table, body.terms, body.k, body.columns, body.threshold),
+    }
+
+
+async def _sql_response(
+    schema,
+    batches,
+    accept: str | None,
+    paginated: bool = False,
+    next_cursor: str | None = None,
+    max_rows: int | None = None,
+    meta: dict | None = None,
+    truncated: bool | None = None,
+):
+    """
+    Encode SQL results by content negotiation: an Arrow IPC stream or NDJSON rows are
+    streamed batch by batch (`X-Next-Cursor` header when paginated), anything else gets JSON.
+    With `max_rows` the rows beyond it are dropped; `truncated` (or, for pages, the given
+    flag) says whether rows were cut off, in the JSON body or as the `X-Truncated` header.
+    `meta` (e.g. the sampling of an approximate answer) is added to the JSON body, or sent
+    as `X-...` headers when streaming.
+    """
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    for key, value in (meta or {}).items():
+        headers["X-" + key.replace("_", "-").title()] = json.dumps(value)
+    streaming = (accept is not None and ARROW_STREAM_MEDIA_TYPE in accept) or _wants_ndjson(accept)
+    if streaming:
+        if max_rows is not None:
+            # Guarded results hold at most one row over the limit, so reading ahead is cheap
+            truncated, batches = await read_ahead(batches, max_rows)
+            batches = take_rows(batches, max_rows)
+        if truncated is not None:
+            headers["X-Truncated"] = json.dumps(truncated)
+        if ARROW_STREAM_MEDIA_TYPE in accept:
+            return StreamingResponse(arrow_stream(schema, batches), media_type=ARROW_STREAM_MEDIA_TYPE, headers=headers)
+        return StreamingResponse(ndjson_rows(batches), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+    
+    data = await collect_records(batches)
+    response = {"row_count": len(data), "data": data, **(meta or {})}
+    if max_rows is not None:
+        response["truncated"] = len(data) > max_rows
+        response["data"] = data = data[:max_rows]
+        response["row_count"] = len(data)
+    elif truncated is not None:
+        response["truncated"] = truncated
+    if paginated:
+        response["next_cursor"] = next_cursor
+    return response
+
+
+def _query_class(name: str | None) -> tuple[str, dict]:
+    name = name or DEFAULT_SQL_QUERY_CLASS
+    if name not in SQL_QUERY_CLASSES:
+        raise HTTPException(status_code=400, detail=f"Unknown query class '{name}'. Available classes: {list(SQL_QUERY_CLASSES)}")
+    return name, SQL_QUERY_CLASSES[name]
+
+
 @app.post("/excel/{table}/query/sql")
-async def query_sql(body: ExcelSQLQuery, table: str):
-    """Run arbitrary SQL and return result rows as JSON. The SQL *must* reference the table name provided in the path parameter."""
+async def query_sql(body: ExcelSQLQuery, table: str, request: Request, accept: str | None = Header(None)):
+    """
+    Run arbitrary SQL and return the result rows. The SQL *must* reference the table name provided in the path parameter.
+    With `page_size` only the first page is returned along with a cursor for the next one.
+    Rows beyond the class's `max_rows` are cut off and `truncated` says so: in the JSON body,
+    or the `X-Truncated` header of streams, on every page.
+    Queries run on a bounded thread pool and are interrupted if the client disconnects.
+    The limits of the query class apply; a query that breaks one is rejected with a
+    structured `detail` ({"code", "message", "hint", ...}) to guide the SQL repair.
+    Aggregations covered by a materialized rollup are transparently rewritten to read it.
+    With `approximate` other aggregations over large tables are estimated from a sample,
+    with confidence intervals; the response then says `"approximate": true`.
+    With `session_id` the query runs in the session's scratch schema, where tables created by
+    earlier queries of the session (e.g. `CREATE TEMP TABLE base AS ...`) can be queried again.
+    """
+    
+    await _require_table(table)
+    query_class, limits = _query_class(body.query_class)
+    max_rows = limits.get("max_rows")
+    db = excel_tables.dbs[query_class]
+    
+    # An approximation asked for but not used (rollup hit, scratch SQL, no sample) is reported as exact
+    sql, meta, session, scratch = body.sql, {"approximate": False} if body.approximate else None, None, False
+    if body.session_id is not None:
+        try:
+            session = await scratch_sessions.open(body.session_id, query_class)
+            sql = scratch_sessions.prepare(session, body.sql)
+        except QueryRejected as exc:
+            raise HTTPException(status_code=exc.status_code, detail=exc.detail) from exc
+        except duckdb.Error as exc:
+            raise HTTPException(status_code=400, detail=str(exc)) from exc
+        scratch = scratch_sessions.is_write(sql) or scratch_sessions.references(session, sql)
+    search_path = session.search_path if session is not None else None
+    
+    # Rewrites and the result cache only know the catalog tables, not a session's scratch tables
+    if not scratch:
+        rewrite = await sql_rollups.rewrite_async(db, sql)
+        if rewrite is not None:
+            sql = rewrite[1]
+        elif body.approximate:
+            estimate = await table_samples.rewrite_async(db, sql)
+            if estimate is not None:
+                sql, meta = estimate
+    
+    cache_key = None
+    if body.page_size is None and not scratch:
+        versions = {name: excel_tables.tables[name]["version"] for name in excel_tables.referenced_tables(body.sql)}
+        cache_key = sql_cache.key(limit_sql(sql, max_rows + 1 if max_rows is not None else None), versions)
+        cached = sql_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            return await _sql_response(cached.schema, as_async(cached.to_batches()), accept, max_rows=max_rows, meta=meta)
     
-    if not table in TABLES.keys():
-        raise HTTPException(status_code=404, detail=f"Table '{table}' not found. Available tables: {list(TABLES)}")
     try:
-        df = db.execute(body.sql).fetch_df()
+        before = await scratch_sessions.tables(session) if scratch and scratch_sessions.is_write(sql) else None
+        cursor, reader = await _until_disconnected(
+            request,
+            execute_guarded(db, sql, query_class, limits, probe_truncation=True, search_path=search_path),
+        )
+        if before is not None:
+            try:
+                await scratch_sessions.enforce(session, before)
+            except BaseException:
+                cursor.close()
+                raise
+    except HTTPException:
+        raise
+    except QueryRejected as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail) from exc
     except Exception as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
     
+    if body.page_size is None:
+        batches = iter_batches(cursor, reader)
+        if cache_key is not None:
+            batches = sql_cache.collect(cache_key, reader.schema, batches)
+        return await _until_disconnected(request, _sql_response(reader.schema, batches, accept, max_rows=max_rows, meta=meta))
+    
+    result = ResultCursor(cursor, reader, body.page_size, max_rows)
+    batches, next_cursor = await _until_disconnected(request, sql_cursors.page(sql_cursors.open(result), result))
+    return await _sql_response(
+        result.schema, as_async(batches), accept, paginated=True, next_cursor=next_cursor, meta=meta, truncated=result.truncated
+    )
+
+
+@app.get("/excel/cursors/{cursor}")
+async def query_sql_page(cursor: str, request: Request, accept: str | None = Header(None)):
+    """Return the next page of a paginated SQL result."""
+    result = sql_cursors.get(cursor)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Cursor '{cursor}' not found or expired.")
+    
+    batches, next_cursor = await _until_disconnected(request, sql_cursors.page(cursor, result))
+    return await _sql_response(
+        result.schema, as_async(batches), accept, paginated=True, next_cursor=next_cursor, truncated=result.truncated
+    )
+
+
+@app.get("/excel/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Return the scratch tables of a session with their columns and row counts."""
+    session = scratch_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found or expired.")
+    tables = await scratch_sessions.tables(session)
     return {
-        "row_count": len(df),
-        "data": df.to_dict(orient="records"),
+        "session_id": session_id,
+        "query_class": session.query_class,
+        "tables": [{"table": name, "rows": table["rows"], "columns": table["columns"]} for name, table in tables.items()],
     }
 
 
+@app.delete("/excel/sessions/{session_id}")
+async def drop_session(session_id: str):
+    """Drop a session's scratch tables ahead of its expiry."""
+    if not await scratch_sessions.drop(session_id):
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found or expired.")
+    return {"session_id": session_id, "dropped": True}
+
 
+@app.post("/admin/excel/reload")
+async def reload_excel():
+    """Ingest added or changed data files of DATA_DIR without a restart and report the table versions."""
+    try:
+        changes = await asyncio.to_thread(excel_tables.load)
+    except (FileNotFoundError, RuntimeError) as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    
+    _refresh_derived()
+    return {
+        **changes,
+        "versions": {name: table["version"] for name, table in excel_tables.tables.items()},
+    }
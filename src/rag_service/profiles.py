@@ -0,0 +1,111 @@
+import asyncio
+import threading
+
+import duckdb
+
+from config import PROFILE_TOP_K, PROFILE_SAMPLE_ROWS
+from excel_store import ExcelCatalog, excel_tables, sql_identifier
+from sql_results import sql_executor
+
+# Column types whose most frequent values are listed in the profile
+CATEGORICAL_TYPES = ("VARCHAR", "BOOLEAN", "ENUM")
+
+
+class TableProfiles:
+    """
+    Per-table profiles (column ranges, null and distinct counts, most frequent values
+    of categorical columns and a few sample rows) computed once per table version.
+    """
+
+    def __init__(self, catalog: ExcelCatalog, top_k: int = 10, sample_rows: int = 5):
+        self.catalog = catalog
+        self.top_k = top_k
+        self.sample_rows = sample_rows
+
+        self._profiles: dict[str, tuple[int, dict]] = {}  # table -> (version, profile)
+        self._pending: dict[tuple[str, int], asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def _compute(self, cursor: duckdb.DuckDBPyConnection, table: str, version: int) -> dict:
+        summary = cursor.execute(f'SUMMARIZE "{table}"').fetchall()
+        row_count = summary[0][10] if summary else 0
+        null_counts = {}
+        if summary:
+            counts = ", ".join(f"count(*) - count({sql_identifier(column)})" for column, *_ in summary)
+            null_counts = dict(zip((column for column, *_ in summary), cursor.execute(f'SELECT {counts} FROM "{table}"').fetchone()))
+
+        columns = []
+        for column, dtype, min_value, max_value, approx_unique, avg, *_ in summary:
+            profile = {
+                "column": column,
+                "type": dtype,
+                "min": min_value,
+                "max": max_value,
+                "null_count": null_counts.get(column, 0),
+                "approx_distinct": min(approx_unique or 0, row_count),
+            }
+            if avg is not None and not dtype.startswith(("DATE", "TIME")):
+                profile["avg"] = avg
+            if dtype.startswith(CATEGORICAL_TYPES):
+                top = cursor.execute(
+                    f'SELECT {sql_identifier(column)}, count(*) AS n FROM "{table}" WHERE {sql_identifier(column)} IS NOT NULL '
+                    f'GROUP BY 1 ORDER BY n DESC, 1 LIMIT {self.top_k}'
+                ).fetchall()
+                profile["top_values"] = [{"value": value, "count": count} for value, count in top]
+            columns.append(profile)
+
+        sample = cursor.execute(
+            f'SELECT * FROM "{table}" USING SAMPLE reservoir({self.sample_rows} ROWS) REPEATABLE (42)'
+        )
+        names = [description[0] for description in sample.description]
+        samples = [dict(zip(names, row)) for row in sample.fetchall()]
+        return {"table": table, "version": version, "row_count": row_count, "columns": columns, "samples": samples}
+
+    async def _profile(self, table: str, version: int) -> dict:
+        cursor = self.catalog.db.cursor()
+        try:
+            return await sql_executor.run(self._compute, cursor, table, version, cursor=cursor)
+        finally:
+            cursor.close()
+
+    async def get(self, table: str) -> dict:
+        """The profile of the table's current version, computed on first use; concurrent callers share one run."""
+        version = self.catalog.tables[table]["version"]
+        with self._lock:
+            cached = self._profiles.get(table)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        key = (table, version)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(self._profile(table, version))
+        try:
+            profile = await asyncio.shield(pending)
+        finally:
+            if pending.done():
+                self._pending.pop(key, None)
+
+        with self._lock:
+            current = self._profiles.get(table)
+            if current is None or current[0] < version:
+                self._profiles[table] = (version, profile)
+        return profile
+
+    async def warm(self) -> None:
+        """Profile every table ahead of the first request and forget removed tables."""
+        with self._lock:
+            for table in set(self._profiles) - set(self.catalog.tables):
+                del self._profiles[table]
+        for table in list(self.catalog.tables):
+            try:
+                await self.get(table)
+            except Exception as exc:
+                print(f"[WARN] Could not profile table '{table}': {exc}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"items": len(self._profiles), "pending": len(self._pending)}
+
+
+table_profiles = TableProfiles(excel_tables, PROFILE_TOP_K, PROFILE_SAMPLE_ROWS)
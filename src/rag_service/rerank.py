@@ -0,0 +1,69 @@
+import asyncio
+import math
+import threading
+
+from langchain_core.embeddings import Embeddings
+
+from config import RERANK_BACKEND, RERANK_MODEL, RERANK_BATCH_SIZE
+from embeddings import aembed_queries
+
+
+class CrossEncoderReranker:
+    """Local CPU cross-encoder; single-label models score 0..1 (`predict` applies the sigmoid to their logits)."""
+
+    name = "cross-encoder"
+
+    def __init__(self, model: str, batch_size: int = 32):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as exc:
+            raise ImportError(
+                "The 'cross-encoder' rerank backend requires `sentence-transformers` (pip install sentence-transformers)."
+            ) from exc
+
+        self.model = model
+        self.batch_size = batch_size
+        self._encoder = CrossEncoder(model, device="cpu")
+
+    def _predict(self, query: str, documents: list[str]) -> list[float]:
+        scores = self._encoder.predict([(query, doc) for doc in documents], batch_size=self.batch_size)
+        return [float(score) for score in scores]
+
+    async def score(self, query: str, documents: list[str], embeddings: Embeddings) -> list[float]:
+        return await asyncio.to_thread(self._predict, query, documents)
+
+
+class EmbeddingReranker:
+    """Cosine similarity between the query and document embeddings of the collection's embedder."""
+
+    name = "embedding"
+
+    async def score(self, query: str, documents: list[str], embeddings: Embeddings) -> list[float]:
+        [query_vector] = await aembed_queries(embeddings, [query])
+        doc_vectors = await embeddings.aembed_documents(documents)
+        query_norm = math.sqrt(sum(x * x for x in query_vector)) or 1.0
+        scores = []
+        for vector in doc_vectors:
+            norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+            scores.append(sum(q * d for q, d in zip(query_vector, vector)) / (query_norm * norm))
+        return scores
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """Build the configured reranker once; fall back to embedding similarity if it can't load."""
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            if RERANK_BACKEND == "cross-encoder":
+                try:
+                    _reranker = CrossEncoderReranker(RERANK_MODEL, batch_size=RERANK_BATCH_SIZE)
+                except Exception as exc:
+                    print(f"[WARN] Could not load cross-encoder '{RERANK_MODEL}', using embedding similarity: {exc}")
+                    _reranker = EmbeddingReranker()
+            else:
+                _reranker = EmbeddingReranker()
+        return _reranker
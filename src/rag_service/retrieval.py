@@ -0,0 +1,129 @@
+import asyncio
+from typing import AsyncIterator
+
+from chromadb.errors import ChromaError
+
+from config import HYBRID_FETCH_FACTOR, RRF_K
+from diversity import mmr_select, collapse_across_queries
+from embeddings import get_embeddings, aembed_queries, normalize_text
+from lexical import bm25_indexes, reciprocal_rank_fusion
+from schemas import RetrievalOptions
+from vectorstore import chroma_pool, result_cache
+
+
+async def _fetch(
+    collection_name: str,
+    queries: list[str],
+    query_embeddings: list[list[float]],
+    options: RetrievalOptions,
+    version: tuple | None,
+) -> list[list[dict]]:
+    """
+    Answer the queries with one multi-embedding Chroma query, pre-filtered by the
+    `where`/`where_document` filters and cut at `max_distance`. In hybrid mode the
+    vector candidates are fused with the BM25 ranking of the same query and with
+    `mmr` the candidates are diversified down to k.
+    """
+    k = options.k
+    hybrid = options.mode == "hybrid" and version is not None
+    fetch_k = k * HYBRID_FETCH_FACTOR if hybrid or options.mmr else k
+
+    filters = {"where": options.where, "where_document": options.where_document}
+    try:
+        fetched = await chroma_pool.aquery(collection_name, query_embeddings, fetch_k, **filters)
+    except ChromaError:
+        # The cached handle may point to a collection that was dropped and recreated
+        chroma_pool.invalidate(collection_name)
+        bm25_indexes.drop(collection_name)
+        fetched = await chroma_pool.aquery(collection_name, query_embeddings, fetch_k, **filters)
+
+    if options.max_distance is not None:
+        fetched = [[doc for doc in documents if doc["distance"] <= options.max_distance] for documents in fetched]
+
+    if hybrid:
+        collection = await chroma_pool.acollection(collection_name)
+        index = await bm25_indexes.get(collection_name, collection, version)
+        # The lexical side honours the same pre-filters (max_distance only applies to vector hits)
+        allowed_ids = await chroma_pool.afilter_ids(collection_name, **filters) if any(filters.values()) else None
+        lexical = await asyncio.gather(*(
+            asyncio.to_thread(index.search, query, fetch_k, allowed_ids) for query in queries
+        ))
+        fetched = [
+            reciprocal_rank_fusion([dense, sparse], fetch_k if options.mmr else k, rrf_k=RRF_K)
+            for dense, sparse in zip(fetched, lexical)
+        ]
+
+    if options.mmr:
+        ids = list({doc["id"] for documents in fetched for doc in documents})
+        vectors = await chroma_pool.aembeddings(collection_name, ids)
+        fetched = [
+            [
+                documents[i]
+                for i in mmr_select(query_embedding, [vectors[doc["id"]] for doc in documents], k, options.lambda_mult)
+            ]
+            for query_embedding, documents in zip(query_embeddings, fetched)
+        ]
+    return fetched
+
+
+async def search_iter(
+    collection_name: str,
+    queries: list[str],
+    options: RetrievalOptions,
+    split: bool = False,
+) -> AsyncIterator[tuple[int, list[dict]]]:
+    """
+    Yield `(query index, documents)` as each query completes. Cached results come
+    first and are reused as long as the collection version stamp is unchanged.
+    The misses are always embedded in one call; they are answered with one Chroma
+    query, or with `split` one concurrent query each so they can be yielded early.
+    `dedup` is not applied here since it needs every result.
+    """
+    version = await chroma_pool.aversion(collection_name)
+    params = options.model_dump_json(include={
+        "k", "mode", "mmr", "lambda_mult", "where", "where_document", "max_distance"
+    })
+    keys = [(collection_name, version, normalize_text(query), params) for query in queries]
+
+    missing = []
+    for idx, key in enumerate(keys):
+        documents = result_cache.get(key) if version is not None else None
+        if documents is None:
+            missing.append(idx)
+        else:
+            yield idx, documents
+
+    if not missing:
+        return
+
+    embeddings = get_embeddings(collection_name)
+    query_embeddings = dict(zip(missing, await aembed_queries(embeddings, [queries[idx] for idx in missing])))
+
+    async def fetch_group(group: list[int]) -> tuple[list[int], list[list[dict]]]:
+        fetched = await _fetch(
+            collection_name,
+            [queries[idx] for idx in group],
+            [query_embeddings[idx] for idx in group],
+            options,
+            version,
+        )
+        return group, fetched
+
+    groups = [[idx] for idx in missing] if split else [missing]
+    for next_group in asyncio.as_completed([fetch_group(group) for group in groups]):
+        group, fetched = await next_group
+        for idx, documents in zip(group, fetched):
+            if version is not None and documents:
+                result_cache.set(keys[idx], documents)
+            yield idx, documents
+
+
+async def search(collection_name: str, queries: list[str], options: RetrievalOptions) -> list[list[dict]]:
+    """Return one document list per query; with `dedup` overlapping chunks are merged across all the queries."""
+    results: list[list[dict]] = [[] for _ in queries]
+    async for idx, documents in search_iter(collection_name, queries, options):
+        results[idx] = documents
+
+    if options.dedup:
+        results = collapse_across_queries(results)
+    return results
@@ -0,0 +1,261 @@
+import asyncio
+import threading
+
+import duckdb
+
+from config import SQL_ROLLUPS
+from excel_store import ExcelCatalog, excel_tables, sql_identifier
+from sql_ast import (
+    UNSUPPORTED_CLASSES,
+    NotCovered,
+    cast_to,
+    column_key,
+    describe,
+    deserialize,
+    is_aggregate,
+    is_grouped,
+    keep_column_names,
+    parse,
+    parse_expression,
+    retarget,
+    single_table_select,
+    with_node,
+)
+from sql_results import sql_executor
+
+ROLLUP_SCHEMA = "rollups"
+# Per-group aggregates stored for every measure; the query aggregates are derived from them
+ROLLUP_AGGREGATES = ("sum", "count", "min", "max")
+
+
+class RollupRegistry:
+    """
+    Materialized group-by tables over frequent dimensions of a table, and the rewrite of
+    covered aggregate queries to read them.
+
+    A rollup holds, per combination of its dimensions, the row count and the sum, count,
+    min and max of each measure; SUM, COUNT, MIN, MAX and AVG over a measure are derived
+    from those. A query is covered when it is a single SELECT over the rollup's table whose
+    columns, outside of those aggregates, are all dimensions. Rollups are rebuilt in every
+    DuckDB instance of the catalog when their table's version changes, and a rollup is only
+    used while it matches the current version, so a rewrite never serves stale rows.
+    """
+
+    def __init__(self, catalog: ExcelCatalog, rollups: dict[str, dict]):
+        self.catalog = catalog
+        self.rollups = rollups
+
+        self._built: dict[str, tuple[int, int]] = {}  # rollup -> (table version, rows)
+        self._hits: dict[str, int] = {name: 0 for name in rollups}
+        self._refreshing: asyncio.Task | None = None
+        self._lock = threading.Lock()
+
+    # ----------------------------------------------------------------------------------
+    # Materialization
+    # ----------------------------------------------------------------------------------
+    @staticmethod
+    def build_sql(name: str, spec: dict) -> str:
+        dimensions = [sql_identifier(dimension) for dimension in spec["dimensions"]]
+        aggregates = [
+            f"{fn}({sql_identifier(measure)}) AS {sql_identifier(f'{fn}__{measure}')}"
+            for measure in spec["measures"]
+            for fn in ROLLUP_AGGREGATES
+        ]
+        return (
+            f"CREATE OR REPLACE TABLE {ROLLUP_SCHEMA}.{sql_identifier(name)} AS "
+            f"SELECT {', '.join(dimensions + aggregates)}, count(*) AS \"__rows\" "
+            f"FROM {sql_identifier(spec['table'])} GROUP BY ALL"
+        )
+
+    def _build(self, name: str, spec: dict) -> int:
+        sql = self.build_sql(name, spec)
+        rows = 0
+        for db in self.catalog.dbs.values():
+            cursor = db.cursor()
+            try:
+                cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {ROLLUP_SCHEMA}")
+                cursor.execute(sql)
+                rows = cursor.execute(f"SELECT count(*) FROM {ROLLUP_SCHEMA}.{sql_identifier(name)}").fetchone()[0]
+            finally:
+                cursor.close()
+        return rows
+
+    async def refresh(self) -> None:
+        """Rebuild the rollups whose table version changed since they were built."""
+        for name, spec in self.rollups.items():
+            table = self.catalog.tables.get(spec["table"])
+            if table is None:
+                with self._lock:
+                    self._built.pop(name, None)
+                continue
+
+            version = table["version"]
+            with self._lock:
+                built = self._built.get(name)
+            if built is not None and built[0] == version:
+                continue
+            try:
+                rows = await sql_executor.run(self._build, name, spec)
+            except Exception as exc:
+                print(f"[WARN] Could not build rollup '{name}': {exc}")
+                continue
+            with self._lock:
+                self._built[name] = (version, rows)
+
+    def schedule_refresh(self) -> None:
+        """Start a background refresh unless one is already running."""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self.refresh())
+
+    def close(self) -> None:
+        if self._refreshing is not None:
+            self._refreshing.cancel()
+
+    # ----------------------------------------------------------------------------------
+    # Rewrite
+    # ----------------------------------------------------------------------------------
+    def _derive(self, cursor: duckdb.DuckDBPyConnection, fn: dict, measures: dict[str, str]) -> dict:
+        """The rollup expression that computes an aggregate of the original query."""
+        if fn["distinct"] or fn["filter"] is not None or fn["order_bys"]["orders"]:
+            raise NotCovered
+        name, children = fn["function_name"].lower(), fn["children"]
+        if name == "count_star" or (
+            name == "count" and len(children) == 1 and children[0]["class"] == "CONSTANT" and not children[0]["value"]["is_null"]
+        ):
+            template = 'coalesce(sum("__rows"), 0)'
+        else:
+            if len(children) != 1 or children[0]["class"] != "COLUMN_REF":
+                raise NotCovered
+            measure = measures.get(column_key(children[0]["column_names"][-1]))
+            if measure is None:
+                raise NotCovered
+            templates = {
+                "sum": "sum({sum})",
+                "count": "coalesce(sum({count}), 0)",
+                "min": "min({min})",
+                "max": "max({max})",
+                "avg": "sum({sum}) / sum({count})",
+            }
+            if name not in templates:
+                raise NotCovered
+            template = templates[name].format(**{agg: sql_identifier(f"{agg}__{measure}") for agg in ROLLUP_AGGREGATES})
+
+        expression = parse_expression(cursor, template)
+        expression["alias"] = fn["alias"]
+        return expression
+
+    def _rewrite_expression(self, cursor, expression, dimensions: set[str], aliases: set[str], measures: dict[str, str]):
+        if isinstance(expression, list):
+            return [self._rewrite_expression(cursor, item, dimensions, aliases, measures) for item in expression]
+        if not isinstance(expression, dict):
+            return expression
+
+        cls = expression.get("class")
+        if cls in UNSUPPORTED_CLASSES:
+            raise NotCovered
+        if cls == "COLUMN_REF":
+            names = expression["column_names"]
+            if column_key(names[-1]) in dimensions or (len(names) == 1 and column_key(names[0]) in aliases):
+                return expression
+            raise NotCovered
+        if is_aggregate(cursor, expression):
+            return self._derive(cursor, expression, measures)
+        return {key: self._rewrite_expression(cursor, value, dimensions, aliases, measures) for key, value in expression.items()}
+
+    def _rewrite_node(self, cursor: duckdb.DuckDBPyConnection, ast: dict, name: str, spec: dict) -> dict:
+        node, source = single_table_select(ast)
+        if source["table_name"].lower() != spec["table"]:
+            raise NotCovered
+
+        dimensions = {column_key(dimension) for dimension in spec["dimensions"]}
+        measures = {column_key(measure): measure for measure in spec["measures"]}
+        # Select aliases can only be referenced after aggregation, and only unambiguously if no column has the name
+        columns = {column_key(column) for column in self.catalog.tables[spec["table"]]["schema"]}
+        aliases = {column_key(item["alias"]) for item in node["select_list"] if item.get("alias")} - columns
+        rewritten = {
+            key: value if key == "from_table" else self._rewrite_expression(
+                cursor, value, dimensions, aliases if key in ("having", "modifiers") else set(), measures
+            )
+            for key, value in node.items()
+        }
+        if not is_grouped(node) and rewritten["select_list"] == node["select_list"]:
+            raise NotCovered  # plain rows, nothing aggregated
+
+        rewritten["from_table"] = retarget(source, ROLLUP_SCHEMA, name)
+        return rewritten
+
+    def rewrite(self, cursor: duckdb.DuckDBPyConnection, sql: str) -> tuple[str, str] | None:
+        """Rewrite the SQL to read a rollup, smallest first; returns (rollup, sql) or None if none covers it."""
+        with self._lock:
+            candidates = sorted(
+                (rows, name)
+                for name, (version, rows) in self._built.items()
+                if (table := self.catalog.tables.get(self.rollups[name]["table"])) is not None and table["version"] == version
+            )
+        if not candidates:
+            return None
+
+        ast = parse(cursor, sql)
+        for _, name in candidates:
+            try:
+                node = self._rewrite_node(cursor, ast, name, self.rollups[name])
+            except (NotCovered, KeyError, TypeError):
+                continue
+
+            # Derived aggregates would otherwise rename unaliased result columns
+            columns = keep_column_names(cursor, sql, ast["statements"][0]["node"]["select_list"], node["select_list"])
+            try:
+                rewritten = deserialize(cursor, with_node(ast, node))
+                derived = describe(cursor, rewritten)
+                if len(derived) == len(columns) == len(node["select_list"]) and derived != columns:
+                    # and widen their types (a count summed from the rollup is a HUGEINT); cast them back
+                    # so the result schema doesn't depend on whether a rollup answered
+                    node["select_list"] = [
+                        item if got == expected else cast_to(cursor, item, expected[1])
+                        for item, got, expected in zip(node["select_list"], derived, columns)
+                    ]
+                    rewritten = deserialize(cursor, with_node(ast, node))
+                    derived = describe(cursor, rewritten)
+                if derived != columns:
+                    continue
+            except duckdb.Error:
+                continue  # the rewrite doesn't bind; the original query still does
+            with self._lock:
+                self._hits[name] += 1
+            return name, rewritten
+        return None
+
+    async def rewrite_async(self, db: duckdb.DuckDBPyConnection, sql: str) -> tuple[str, str] | None:
+        """`rewrite` on the SQL pool with a cursor of its own; stale rollups are rebuilt in the background."""
+        with self._lock:
+            stale = any(
+                (table := self.catalog.tables.get(spec["table"])) is not None
+                and self._built.get(name, (None,))[0] != table["version"]
+                for name, spec in self.rollups.items()
+            )
+            built = bool(self._built)
+        if stale:
+            self.schedule_refresh()
+        if not built:
+            return None
+        cursor = db.cursor()
+        try:
+            return await sql_executor.run(self.rewrite, cursor, sql, cursor=cursor)
+        except duckdb.Error:
+            return None  # the query itself reports the error when it runs
+        finally:
+            cursor.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    "version": self._built[name][0] if name in self._built else None,
+                    "rows": self._built[name][1] if name in self._built else None,
+                    "hits": self._hits[name],
+                }
+                for name in self.rollups
+            }
+
+
+sql_rollups = RollupRegistry(excel_tables, SQL_ROLLUPS)
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import re
+from pathlib import Path
+
+from config import SCHEMA_TOP_K, SCHEMA_DESCRIPTIONS_PATH
+from excel_store import ExcelCatalog, excel_tables
+from lexical import BM25Index, tokenize
+from profiles import TableProfiles, table_profiles
+from value_index import normalize_value
+
+# Column matches that make up a table's score, on top of its own name and description
+TABLE_SCORE_COLUMNS = 3
+# Question words that say nothing about which columns are needed
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "de", "did", "do", "does", "for", "from", "give", "how", "in", "is",
+    "it", "list", "me", "of", "on", "or", "per", "show", "the", "to", "us", "was", "we", "were", "what", "which", "with",
+}
+
+
+def split_name(name: str) -> str:
+    """Column names as words: "UnitsSold" / "units_sold" ➜ "Units Sold" / "units sold"."""
+    return re.sub(r"(?<=[a-z])(?=[A-Z])|_", " ", name).strip()
+
+
+class SchemaIndex:
+    """
+    BM25 index over the columns of every table, to give the SQL generator only the part
+    of the schema a question needs.
+
+    A column is indexed by its name, its description and what its profile says about its
+    values (most frequent values, range), so "profit in Canada" finds both
+    `Profit` and the `Country` column that holds "Canada". Tables are ranked by their own
+    name and description plus their best column matches. The index is rebuilt whenever a
+    table version changes.
+    """
+
+    def __init__(self, catalog: ExcelCatalog, profiles: TableProfiles, descriptions_path: Path, top_k: int = 12):
+        self.catalog = catalog
+        self.profiles = profiles
+        self.descriptions_path = descriptions_path
+        self.top_k = top_k
+
+        self._index: BM25Index | None = None
+        self._versions: tuple | None = None
+        self._lock = asyncio.Lock()
+
+    def _descriptions(self) -> dict:
+        try:
+            return json.loads(self.descriptions_path.read_text())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as exc:
+            print(f"[WARN] Could not read schema descriptions '{self.descriptions_path}': {exc}")
+            return {}
+
+    async def _build(self) -> BM25Index:
+        index = BM25Index()
+        descriptions = self._descriptions()
+        for table, meta in list(self.catalog.tables.items()):
+            described = descriptions.get(table, {})
+            try:
+                profile = {column["column"]: column for column in (await self.profiles.get(table))["columns"]}
+            except Exception as exc:
+                print(f"[WARN] Indexing table '{table}' without its profile: {exc}")
+                profile = {}
+
+            index.add(table, normalize_value(f"{split_name(table)} {described.get('description', '')}"), {
+                "kind": "table", "table": table, "description": described.get("description"),
+            })
+            for position, (column, dtype) in enumerate(meta["schema"].items()):
+                description = described.get("columns", {}).get(column)
+                values = profile.get(column, {})
+                content = " ".join(filter(None, [
+                    split_name(column),
+                    split_name(column),  # the name weighs more than the values
+                    description,
+                    " ".join(str(top["value"]) for top in values.get("top_values", [])),
+                    " ".join(str(values[bound]) for bound in ("min", "max") if values.get(bound) is not None),
+                ]))
+                index.add(f"{table}.{column}", normalize_value(content), {
+                    "kind": "column",
+                    "table": table,
+                    "column": column,
+                    "type": dtype,
+                    "description": description,
+                    "position": position,
+                })
+        return index
+
+    async def index(self) -> BM25Index:
+        """The index of the current table versions, rebuilt on first use after a change."""
+        versions = tuple(sorted((name, table["version"]) for name, table in self.catalog.tables.items()))
+        async with self._lock:
+            if self._index is None or self._versions != versions:
+                self._index = await self._build()
+                self._versions = versions
+            return self._index
+
+    async def search(self, question: str, k: int | None = None, max_tables: int = 1, tables: list[str] | None = None) -> list[dict]:
+        """
+        The tables most relevant to the question, best first, each with `k` columns in table
+        order: its best matches, padded with the unmatched columns in table order, since a
+        question doesn't name every column its SQL needs.
+        """
+        k = k or self.top_k
+        index = await self.index()
+        allowed = {name for name in self.catalog.tables if tables is None or name in tables}
+        # Names and contents are indexed with plurals folded ("Discounts" ➜ "discount"), so the question is too
+        terms = [normalize_value(term) for term in tokenize(question) if term not in STOPWORDS]
+        hits = index.search(" ".join(terms), len(index))
+
+        table_scores = {name: 0.0 for name in allowed}
+        column_hits: dict[str, list[dict]] = {name: [] for name in allowed}
+        for hit in hits:
+            meta = hit["metadata"]
+            if meta["table"] not in allowed:
+                continue
+            if meta["kind"] == "table":
+                table_scores[meta["table"]] += hit["bm25_score"]
+            else:
+                column_hits[meta["table"]].append({**meta, "score": hit["bm25_score"]})
+        for name, columns in column_hits.items():
+            table_scores[name] += sum(column["score"] for column in columns[:TABLE_SCORE_COLUMNS])
+
+        ranked = sorted(allowed, key=lambda name: (-table_scores[name], name))[:max_tables]
+        results = []
+        for name in ranked:
+            schema = self.catalog.tables[name]["schema"]
+            columns = column_hits[name][:k]
+            matched = {column["column"] for column in columns}
+            columns += [
+                {"column": column, "type": dtype, "score": 0.0, "position": position}
+                for position, (column, dtype) in enumerate(schema.items())
+                if column not in matched
+            ][:k - len(columns)]
+            results.append({
+                "table": name,
+                "score": table_scores[name],
+                "pruned": len(columns) < len(schema),
+                "column_count": len(schema),
+                "columns": [
+                    {key: column[key] for key in ("column", "type", "description", "score") if column.get(key) is not None}
+                    for column in sorted(columns, key=lambda column: column["position"])
+                ],
+            })
+        return results
+
+
+schema_index = SchemaIndex(excel_tables, table_profiles, SCHEMA_DESCRIPTIONS_PATH, SCHEMA_TOP_K)
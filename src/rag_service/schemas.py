@@ -1,11 +1,66 @@
+from typing import Any, Literal
+
 from pydantic import BaseModel, Field
 
-class Query(BaseModel):
+class RetrievalOptions(BaseModel):
+    """Options shared by the retrieval endpoints."""
+    k: int = 10
+    mode: Literal["vector", "hybrid"] = Field(
+        "vector", description="'hybrid' fuses BM25 and vector rankings with reciprocal rank fusion."
+    )
+    mmr: bool = Field(False, description="Diversify the top-k with maximal marginal relevance.")
+    lambda_mult: float = Field(0.5, ge=0, le=1, description="MMR trade-off: 1 = relevance only, 0 = diversity only.")
+    dedup: bool = Field(False, description="Drop duplicates and merge overlapping chunks of the same source across all queries.")
+    where: dict[str, Any] | None = Field(None, description="Chroma metadata pre-filter, e.g. {'source': 'policy.pdf'}.")
+    where_document: dict[str, Any] | None = Field(None, description="Chroma document pre-filter, e.g. {'$contains': 'HR-104'}.")
+    max_distance: float | None = Field(None, description="Drop vector hits farther than this distance from the query.")
+
+class Query(RetrievalOptions):
     """Model for a simple text query to retrieve from a vector store."""
     query: str
-    k: int = 10
+
+class BatchQuery(RetrievalOptions):
+    """Model for several text queries answered with one embedding call and one vector store query."""
+    queries: list[str] = Field(..., min_length=1)
+
+class RerankRequest(BaseModel):
+    """Model for scoring retrieved documents against a query."""
+    query: str
+    documents: list[str]
+    collection_name: str | None = Field(None, description="Selects the embedder used by the 'embedding' backend.")
+    threshold: float | None = Field(None, description="Relevance cutoff; defaults to the backend's threshold.")
+    min_keep: int = Field(1, description="Always flag at least this many top documents as relevant.")
+
+class SchemaSearch(BaseModel):
+    """Model for finding the tables and columns relevant to a question."""
+    question: str
+    k: int | None = Field(None, ge=1, le=500, description="Columns per table; defaults to the service's SCHEMA_TOP_K.")
+    max_tables: int = Field(1, ge=1, le=50, description="How many of the best matching tables to return.")
+    tables: list[str] | None = Field(None, description="Only consider these tables.")
+
+class ValueResolve(BaseModel):
+    """Model for mapping filter values as a user wrote them to the values stored in a table."""
+    terms: list[str] = Field(..., min_length=1, max_length=50)
+    k: int = Field(3, ge=1, le=20, description="Matches returned per term.")
+    columns: list[str] | None = Field(None, description="Only match values of these columns.")
+    threshold: float | None = Field(None, ge=0, le=1, description="Minimum similarity; defaults to the service's VALUE_MATCH_THRESHOLD.")
 
 class ExcelSQLQuery(BaseModel):
-    """Model for SQL queries to be executed on Excel files."""
+    """Model for SQL queries to be executed on the data tables."""
     sql: str
+    page_size: int | None = Field(
+        None, ge=1, le=100_000, description="Return the rows in pages of this size with a `next_cursor` to fetch the next one."
+    )
+    approximate: bool = Field(
+        False, description="Estimate aggregates over large tables from a sample, with confidence intervals."
+    )
+    query_class: str | None = Field(
+        None, description="Guardrail class (timeout, row cap, memory and cost limits); defaults to the service's default class."
+    )
+    session_id: str | None = Field(
+        None,
+        min_length=1,
+        max_length=128,
+        description="Run in the session's scratch schema: tables it creates (also TEMP ones) stay queryable by its later queries.",
+    )
 
@@ -0,0 +1,238 @@
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import duckdb
+
+from config import SCRATCH_TTL, SCRATCH_MAX_BYTES, SCRATCH_MAX_SESSIONS
+from excel_store import ExcelCatalog, excel_tables, sql_identifier
+from sql_guard import QueryRejected
+from sql_results import canonical_sql, fetch_all, is_read_query, split_statements
+
+SCRATCH_SCHEMA_PREFIX = "scratch_"
+# The statements besides queries a session may run, on canonical SQL: creating and dropping its tables and views
+_NAME = r'(?:"(?:[^"]|"")*"|[a-z_][\w$]*)'
+_SCRATCH_DDL_RE = re.compile(
+    r"^(?P<head>create (?:or replace )?(?:temp(?:orary)? )?(?:table|view) (?:if not exists )?|drop (?:table|view) (?:if exists )?)"
+    rf"(?P<name>{_NAME}(?: ?\. ?{_NAME})*)(?P<tail>(?:[ (].*)?)$",
+    re.DOTALL,
+)
+_NAME_PART_RE = re.compile(r'"((?:[^"]|"")*)"|([^\s."]+)')
+# Bytes per value by DuckDB type, to estimate what a scratch table holds; other types count VARIABLE_WIDTH
+_TYPE_WIDTHS = {
+    "BOOLEAN": 1, "TINYINT": 1, "UTINYINT": 1, "SMALLINT": 2, "USMALLINT": 2, "INTEGER": 4, "UINTEGER": 4,
+    "BIGINT": 8, "UBIGINT": 8, "HUGEINT": 16, "UHUGEINT": 16, "FLOAT": 4, "DOUBLE": 8, "DECIMAL": 16,
+    "DATE": 4, "TIME": 8, "TIMESTAMP": 8, "INTERVAL": 16, "UUID": 16,
+}
+VARIABLE_WIDTH = 32
+
+
+class ScratchSession:
+    """A session's scratch schema, pinned to the DuckDB instance of the query class that opened it."""
+
+    def __init__(self, session_id: str, schema: str, query_class: str):
+        self.session_id = session_id
+        self.schema = schema
+        self.query_class = query_class
+        self.tables: set[str] = set()
+        self.touched = time.monotonic()
+
+    @property
+    def search_path(self) -> str:
+        return f"{self.schema},main"
+
+
+class ScratchSessions:
+    """
+    Session-scoped schemas for intermediate results of multi-step analysis.
+
+    Queries sent with a session id resolve unqualified names in the session's schema
+    first, and the tables they create (`CREATE TEMP TABLE` included) land there, so a
+    later step or turn can query them again. A session is dropped with its tables once
+    idle for `ttl` seconds, or as the least recently used one beyond `max_sessions`,
+    and a statement that grows it beyond `max_bytes` is undone and rejected.
+    """
+
+    def __init__(self, catalog: ExcelCatalog, ttl: float, max_bytes: int, max_sessions: int):
+        self.catalog = catalog
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+
+        self._sessions: OrderedDict[str, ScratchSession] = OrderedDict()
+        self._sweeping: asyncio.Task | None = None
+        self._lock = threading.Lock()
+
+    # ----------------------------------------------------------------------------------
+    # Lifecycle
+    # ----------------------------------------------------------------------------------
+    def _expire(self) -> list[ScratchSession]:
+        now = time.monotonic()
+        expired = [key for key, session in self._sessions.items() if now - session.touched >= self.ttl]
+        dropped = [self._sessions.pop(key) for key in expired]
+        while len(self._sessions) > self.max_sessions:
+            dropped.append(self._sessions.popitem(last=False)[1])
+        return dropped
+
+    async def _drop_schemas(self, sessions: list[ScratchSession]) -> None:
+        for session in sessions:
+            try:
+                await fetch_all(self.catalog.dbs[session.query_class], f"DROP SCHEMA IF EXISTS {sql_identifier(session.schema)} CASCADE")
+            except Exception as exc:
+                print(f"[WARN] Could not drop scratch schema of session '{session.session_id}': {exc}")
+
+    async def open(self, session_id: str, query_class: str) -> ScratchSession:
+        """The session's scratch schema, created on first use."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                schema = SCRATCH_SCHEMA_PREFIX + hashlib.blake2b(session_id.encode(), digest_size=8).hexdigest()
+                session = self._sessions[session_id] = ScratchSession(session_id, schema, query_class)
+                created = True
+            else:
+                self._sessions.move_to_end(session_id)
+                created = False
+            session.touched = time.monotonic()
+            dropped = self._expire()
+        await self._drop_schemas(dropped)
+
+        if session.query_class != query_class:
+            raise QueryRejected(409, {
+                "code": "session_class_mismatch",
+                "message": f"Session '{session_id}' keeps its scratch tables with '{session.query_class}' queries.",
+                "query_class": query_class,
+                "session_class": session.query_class,
+                "hint": f"Send the session's queries with query_class '{session.query_class}', or use a new session.",
+            })
+        if created:
+            await fetch_all(self.catalog.dbs[query_class], f"CREATE SCHEMA IF NOT EXISTS {sql_identifier(session.schema)}")
+        return session
+
+    def get(self, session_id: str) -> ScratchSession | None:
+        """The open session, or None if there is none or it has expired."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or time.monotonic() - session.touched >= self.ttl:
+                return None
+            self._sessions.move_to_end(session_id)
+            session.touched = time.monotonic()
+            return session
+
+    async def drop(self, session_id: str) -> bool:
+        """Drop the session and its tables; returns whether it existed."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            await self._drop_schemas([session])
+        return session is not None
+
+    async def sweep(self, interval: float) -> None:
+        """Drop expired sessions every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            with self._lock:
+                dropped = self._expire()
+            await self._drop_schemas(dropped)
+
+    def start(self) -> None:
+        self._sweeping = asyncio.create_task(self.sweep(min(self.ttl, 60.0)))
+
+    def close(self) -> None:
+        if self._sweeping is not None:
+            self._sweeping.cancel()
+
+    # ----------------------------------------------------------------------------------
+    # Queries
+    # ----------------------------------------------------------------------------------
+    @staticmethod
+    def prepare(session: ScratchSession, sql: str) -> str:
+        """
+        The SQL as run in the session: queries pass unchanged, tables and views created or
+        dropped are qualified with the session's schema (temp ones included, which would only
+        live as long as the request's cursor), and any other statement is rejected. A statement
+        can't reach beyond the schema, e.g. to drop a catalog view every client reads.
+        """
+        statements = []
+        for index, statement in enumerate(split_statements(sql)):
+            canonical = canonical_sql(statement)
+            if is_read_query(canonical):
+                statements.append(statement)
+                continue
+            match = _SCRATCH_DDL_RE.match(canonical)
+            parts = [quoted.replace('""', '"') if quoted else bare for quoted, bare in _NAME_PART_RE.findall(match["name"])] if match else []
+            if not parts or len(parts) > 2 or (len(parts) == 2 and parts[0] != session.schema):
+                raise QueryRejected(403, {
+                    "code": "statement_not_allowed",
+                    "message": f"Statement {index + 1} is not allowed in a session: only queries and creating or dropping the session's own tables and views are.",
+                    "statement": index,
+                    "hint": "Query the tables, and keep intermediates with CREATE TEMP TABLE <name> AS SELECT ... under an unqualified name.",
+                })
+            head = re.sub(r"temp(?:orary)? ", "", match["head"])
+            statements.append(f"{head}{sql_identifier(session.schema)}.{sql_identifier(parts[-1])}{match['tail']}")
+        return ";\n".join(statements)
+
+    @staticmethod
+    def is_write(sql: str) -> bool:
+        """Whether the SQL may change scratch tables: anything but a single plain query."""
+        try:
+            statements = split_statements(sql)
+        except duckdb.ParserException:
+            return True
+        return len(statements) != 1 or not is_read_query(canonical_sql(statements[0]))
+
+    def references(self, session: ScratchSession, sql: str) -> bool:
+        """Whether the SQL mentions one of the session's scratch tables."""
+        return any(re.search(rf"\b{re.escape(table)}\b", sql, re.IGNORECASE) for table in session.tables)
+
+    async def tables(self, session: ScratchSession) -> dict[str, dict]:
+        """The session's tables and views with their row count, columns and estimated size in bytes."""
+        rows = await fetch_all(
+            self.catalog.dbs[session.query_class],
+            "SELECT c.table_name, coalesce(t.estimated_size, 0), c.column_name, c.data_type "
+            "FROM duckdb_columns() c LEFT JOIN duckdb_tables() t USING (database_name, schema_name, table_name) "
+            f"WHERE c.schema_name = '{session.schema}' ORDER BY c.table_name, c.column_index",
+        )
+        tables: dict[str, dict] = {}
+        for table, row_count, column, dtype in rows:
+            entry = tables.setdefault(table, {"rows": row_count, "columns": {}, "bytes": 0})
+            entry["columns"][column] = dtype
+            entry["bytes"] += row_count * _TYPE_WIDTHS.get(re.split(r"[ (]", dtype, 1)[0], VARIABLE_WIDTH)
+        return tables
+
+    async def enforce(self, session: ScratchSession, before: dict[str, dict]) -> None:
+        """
+        After a write, record the session's tables and check its size; over `max_bytes` the
+        tables the statement created or replaced are dropped and the write is rejected.
+        """
+        after = await self.tables(session)
+        used = sum(table["bytes"] for table in after.values())
+        if used > self.max_bytes:
+            changed = [name for name, table in after.items() if table["bytes"] and before.get(name) != table]
+            for name in changed:
+                await fetch_all(
+                    self.catalog.dbs[session.query_class],
+                    f"DROP TABLE IF EXISTS {sql_identifier(session.schema)}.{sql_identifier(name)}",
+                )
+                del after[name]
+            session.tables = set(after)
+            raise QueryRejected(413, {
+                "code": "scratch_limit_exceeded",
+                "message": f"The session's scratch tables would hold about {used / 2**20:.1f} MiB, over the {self.max_bytes / 2**20:.1f} MiB limit.",
+                "dropped": changed,
+                "max_bytes": self.max_bytes,
+                "hint": "Keep only the columns and rows later steps need, aggregate first, or DROP scratch tables that are no longer used.",
+            })
+        session.tables = set(after)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "tables": sum(len(session.tables) for session in self._sessions.values()),
+            }
+
+
+scratch_sessions = ScratchSessions(excel_tables, SCRATCH_TTL, SCRATCH_MAX_BYTES, SCRATCH_MAX_SESSIONS)
@@ -0,0 +1,121 @@
+import copy
+import json
+import threading
+
+import duckdb
+
+# Expression classes the query rewrites don't handle
+UNSUPPORTED_CLASSES = {"SUBQUERY", "WINDOW", "STAR", "COLUMNS", "LAMBDA", "PARAMETER"}
+
+_aggregate_functions: set[str] | None = None
+_lock = threading.Lock()
+
+
+class NotCovered(Exception):
+    """The query has a shape or needs data that a rewrite can't handle."""
+
+
+def column_key(name: str) -> str:
+    """Identifiers are case-insensitive in DuckDB."""
+    return name.lower()
+
+
+def parse(cursor: duckdb.DuckDBPyConnection, sql: str) -> dict | None:
+    """DuckDB's own parse tree of the SQL as JSON, or None if it doesn't parse."""
+    ast = json.loads(cursor.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+    return None if ast.get("error") else ast
+
+
+def deserialize(cursor: duckdb.DuckDBPyConnection, ast: dict) -> str:
+    return cursor.execute("SELECT json_deserialize_sql(?::JSON)", [json.dumps(ast)]).fetchone()[0]
+
+
+def parse_expression(cursor: duckdb.DuckDBPyConnection, expression: str, **placeholders: dict) -> dict:
+    """
+    Parse a single SQL expression; column references named after a keyword of
+    `placeholders` are replaced by (a copy of) the given expression tree.
+    """
+    tree = parse(cursor, f"SELECT {expression}")["statements"][0]["node"]["select_list"][0]
+
+    def substitute(node):
+        if isinstance(node, list):
+            return [substitute(item) for item in node]
+        if not isinstance(node, dict):
+            return node
+        if node.get("class") == "COLUMN_REF" and len(node["column_names"]) == 1 and node["column_names"][0] in placeholders:
+            return copy.deepcopy(placeholders[node["column_names"][0]])
+        return {key: substitute(value) for key, value in node.items()}
+
+    return substitute(tree) if placeholders else tree
+
+
+def aggregate_functions(cursor: duckdb.DuckDBPyConnection) -> set[str]:
+    """Names of all aggregate functions, to tell them apart from scalar ones."""
+    global _aggregate_functions
+    with _lock:
+        if _aggregate_functions is None:
+            rows = cursor.execute("SELECT DISTINCT function_name FROM duckdb_functions() WHERE function_type = 'aggregate'").fetchall()
+            _aggregate_functions = {name for name, in rows} | {"count_star"}
+        return _aggregate_functions
+
+
+def is_aggregate(cursor: duckdb.DuckDBPyConnection, expression: dict) -> bool:
+    return expression.get("class") == "FUNCTION" and expression["function_name"].lower() in aggregate_functions(cursor)
+
+
+def single_table_select(ast: dict | None) -> tuple[dict, dict]:
+    """
+    The SELECT node and its base table of a query that reads one table without CTEs,
+    sampling or QUALIFY; anything else raises `NotCovered`.
+    """
+    if ast is None or len(ast["statements"]) != 1:
+        raise NotCovered
+    node = ast["statements"][0]["node"]
+    source = node.get("from_table") or {}
+    if (
+        node.get("type") != "SELECT_NODE"
+        or source.get("type") != "BASE_TABLE"
+        or source.get("schema_name") or source.get("catalog_name") or source.get("sample")
+        or node["cte_map"]["map"] or node.get("qualify") or node.get("sample")
+        or node.get("aggregate_handling") not in ("STANDARD_HANDLING", "FORCE_AGGREGATES")  # GROUP BY ALL
+    ):
+        raise NotCovered
+    return node, source
+
+
+def is_grouped(node: dict) -> bool:
+    return bool(node["group_expressions"]) or node["aggregate_handling"] == "FORCE_AGGREGATES"
+
+
+def retarget(source: dict, schema: str, table: str) -> dict:
+    """The base table reference pointed at another table, aliased so qualified column references stay valid."""
+    return {**source, "schema_name": schema, "table_name": table, "alias": source["alias"] or source["table_name"]}
+
+
+def describe(cursor: duckdb.DuckDBPyConnection, sql: str) -> list[tuple[str, str]]:
+    """Result column names and types of a query."""
+    return [(row[0], row[1]) for row in cursor.execute(f"DESCRIBE {sql}").fetchall()]
+
+
+def keep_column_names(
+    cursor: duckdb.DuckDBPyConnection, sql: str, original: list[dict], rewritten: list[dict]
+) -> list[tuple[str, str]]:
+    """Alias rewritten select items with the result column names of the original query; returns its columns and types."""
+    columns = describe(cursor, sql)
+    if len(columns) != len(original):
+        return columns
+    for item, before, (column, _) in zip(rewritten, original, columns):
+        if not item["alias"] and item != before:
+            item["alias"] = column
+    return columns
+
+
+def cast_to(cursor: duckdb.DuckDBPyConnection, expression: dict, dtype: str) -> dict:
+    """The expression cast to `dtype`, under the same alias."""
+    cast = parse_expression(cursor, f"CAST(value AS {dtype})", value={**expression, "alias": ""})
+    cast["alias"] = expression["alias"]
+    return cast
+
+
+def with_node(ast: dict, node: dict) -> dict:
+    return {**ast, "statements": [{**ast["statements"][0], "node": node}]}
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import re
+
+import duckdb
+import pyarrow as pa
+
+from config import SQL_BATCH_SIZE
+from sql_results import canonical_sql, execute_reader, is_read_query, split_statements
+
+# A trailing statement terminator, possibly followed by comments
+_TRAILING_SEMICOLON_RE = re.compile(r";(?:\s|--[^\n]*|/\*.*?\*/)*$", re.DOTALL)
+# Operators that emit every combination of their inputs
+_PRODUCT_OPERATORS = {"CROSS_PRODUCT", "NESTED_LOOP_JOIN", "BLOCKWISE_NL_JOIN"}
+
+
+class QueryRejected(Exception):
+    """A query stopped by a guardrail. `detail` is a structured error the SQL repair loop can act on."""
+
+    def __init__(self, status_code: int, detail: dict):
+        super().__init__(detail["message"])
+        self.status_code = status_code
+        self.detail = detail
+
+
+def limit_sql(sql: str, limit: int | None) -> str:
+    """Wrap a read-only query so it returns at most `limit` rows. Other statements are left as is."""
+    if limit is None or not is_read_query(canonical_sql(sql)):
+        return sql
+    body = _TRAILING_SEMICOLON_RE.sub("", sql.strip())
+    # The newline keeps a trailing line comment from swallowing the closing parenthesis
+    return f"SELECT * FROM (\n{body}\n) AS limited LIMIT {limit}"
+
+
+def _estimate(node: dict, operators: list[dict]) -> float:
+    """
+    Estimated output rows of a plan node. Nodes with an estimate of their own, or that
+    multiply their inputs, are recorded in `operators`; the rest pass their input through.
+    """
+    children = [_estimate(child, operators) for child in node.get("children", [])]
+    estimate = node.get("extra_info", {}).get("Estimated Cardinality")
+    if estimate is not None:
+        rows = float(str(estimate).lstrip("~"))
+    elif node["name"] in _PRODUCT_OPERATORS and children:
+        rows = 1.0
+        for child in children:
+            rows *= child
+    else:
+        return max(children, default=0.0)
+    operators.append({"operator": node["name"], "estimated_rows": rows})
+    return rows
+
+
+def estimate_cost(cursor: duckdb.DuckDBPyConnection, sql: str) -> tuple[float, list[dict]]:
+    """
+    Cost of a statement as the rows its plan processes, summed over all operators, from the
+    optimizer's estimates. Returns the cost and the operators, most expensive first.
+    """
+    [(_, plan)] = cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}").fetchall()
+    operators: list[dict] = []
+    for root in json.loads(plan):
+        _estimate(root, operators)
+    operators.sort(key=lambda op: op["estimated_rows"], reverse=True)
+    return sum(op["estimated_rows"] for op in operators), operators
+
+
+def _cost_check(query_class: str, max_cost: float):
+    """A check for `execute_reader` that rejects queries and CREATE ... AS whose plan costs over `max_cost`."""
+
+    def check(cursor: duckdb.DuckDBPyConnection, statement: str) -> None:
+        canonical = canonical_sql(statement)
+        if not (is_read_query(canonical) or canonical.startswith("create")):
+            return
+        cost, operators = estimate_cost(cursor, statement)
+        if cost > max_cost:
+            raise QueryRejected(422, {
+                "code": "cost_limit_exceeded",
+                "message": f"The query plan is estimated to process {cost:.3g} rows, over the {max_cost:.3g} limit of '{query_class}' queries.",
+                "query_class": query_class,
+                "estimated_cost": cost,
+                "max_cost": max_cost,
+                "operators": operators[:5],
+                "hint": "Join on key columns instead of producing a cross product, and filter or aggregate before joining.",
+            })
+
+    return check
+
+
+async def execute_guarded(
+    db: duckdb.DuckDBPyConnection,
+    sql: str,
+    query_class: str,
+    limits: dict,
+    batch_size: int = SQL_BATCH_SIZE,
+    probe_truncation: bool = False,
+    search_path: str | None = None,
+) -> tuple[duckdb.DuckDBPyConnection, pa.RecordBatchReader]:
+    """
+    Run the SQL under the limits of its query class: reject plans over `max_cost`, cap
+    read-only results at `max_rows` and interrupt the query after `timeout` seconds.
+    Each statement of a script is guarded on its own and the last one's result returned.
+    With `probe_truncation` one extra row is fetched so the caller can tell the result
+    was cut off. `search_path` resolves unqualified names (a session's scratch schema first).
+    Guardrail violations raise `QueryRejected`; SQL errors propagate unchanged.
+    """
+    max_rows = limits.get("max_rows")
+    statements = split_statements(sql)
+    if not statements:
+        raise duckdb.InvalidInputException("The SQL contains no statement.")
+    statements = [limit_sql(statement, max_rows) for statement in statements[:-1]] + [
+        limit_sql(statements[-1], max_rows + 1 if max_rows is not None and probe_truncation else max_rows)
+    ]
+    max_cost = limits.get("max_cost")
+    check = _cost_check(query_class, max_cost) if max_cost is not None else None
+
+    timeout = limits.get("timeout")
+    try:
+        return await execute_reader(db, statements, batch_size, timeout=timeout, search_path=search_path, check=check)
+    except asyncio.TimeoutError as exc:
+        raise QueryRejected(408, {
+            "code": "timeout",
+            "message": f"The query did not finish within {timeout:g}s, the limit of '{query_class}' queries.",
+            "query_class": query_class,
+            "timeout": timeout,
+            "hint": "Filter or aggregate earlier so less data is scanned and joined.",
+        }) from exc
+    except duckdb.OutOfMemoryException as exc:
+        raise QueryRejected(422, {
+            "code": "out_of_memory",
+            "message": f"The query ran out of memory: {exc}",
+            "query_class": query_class,
+            "memory_limit": limits.get("memory_limit"),
+            "hint": "Aggregate before joining or sorting and select only the columns you need.",
+        }) from exc
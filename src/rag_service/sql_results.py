@@ -0,0 +1,421 @@
+import asyncio
+import datetime
+import decimal
+import io
+import json
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterable
+
+import duckdb
+import pyarrow as pa
+
+from caches import SizedLRUCache
+from config import (
+    SQL_BATCH_SIZE,
+    SQL_CURSOR_TTL,
+    SQL_MAX_CURSORS,
+    SQL_CACHE_MAX_BYTES,
+    SQL_CACHE_MAX_RESULT_BYTES,
+    SQL_WORKERS,
+)
+
+_SQL_TOKEN_RE = re.compile(
+    r"(?P<literal>'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|(?P<space>--[^\n]*|/\*.*?\*/|\s+)",
+    re.DOTALL,
+)
+# Queries whose result may change without the data changing are never cached
+_VOLATILE_SQL_RE = re.compile(
+    r"\b(random|uuid|gen_random_uuid|setseed|nextval|now|today|current_date|current_time|current_timestamp"
+    r"|get_current_time|get_current_timestamp|read_\w+|glob)\b"
+)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return str(value)
+
+
+def canonical_sql(sql: str) -> str:
+    """
+    Normalise SQL text for cache keys: comments dropped, whitespace collapsed and
+    everything outside string literals and quoted identifiers lower-cased.
+    """
+    parts: list[str | None] = []  # None stands for whitespace or a comment
+    pos = 0
+    for match in _SQL_TOKEN_RE.finditer(sql):
+        parts.append(sql[pos:match.start()].lower())
+        parts.append(match.group() if match.group("literal") else None)
+        pos = match.end()
+    parts.append(sql[pos:].lower())
+
+    canonical: list[str] = []
+    for part in parts:
+        if part is None:
+            if canonical and canonical[-1] != " ":
+                canonical.append(" ")
+        elif part:
+            canonical.append(part)
+    return "".join(canonical).strip().rstrip(";").strip()
+
+
+class SQLExecutor:
+    """
+    Bounded thread pool for DuckDB calls, so a slow query never stalls the event loop.
+    Each call works on a cursor of its own; cancelling the awaiting task interrupts
+    the query on that cursor and waits for the call to return before re-raising,
+    so the caller can close the cursor safely.
+    """
+
+    def __init__(self, workers: int = 4):
+        self.workers = max(workers, 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="duckdb")
+
+    async def run(self, fn: Callable, *args, cursor: duckdb.DuckDBPyConnection | None = None):
+        future = self._pool.submit(fn, *args)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if not future.cancel():  # already running
+                if cursor is not None:
+                    cursor.interrupt()
+                waiter = asyncio.wrap_future(future)
+                await asyncio.wait([waiter])
+                if not waiter.cancelled():
+                    waiter.exception()  # the interrupt error is expected, mark it retrieved
+            raise
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def is_read_query(canonical: str) -> bool:
+    """Whether canonical SQL is a plain query (SELECT, WITH or FROM-first) rather than a statement."""
+    return canonical.startswith(("select", "with", "from"))
+
+
+def split_statements(sql: str) -> list[str]:
+    """The statements of a SQL script, in order; raises `duckdb.ParserException` if it doesn't parse."""
+    return [statement.query for statement in duckdb.extract_statements(sql)]
+
+
+def batch_records(batches: list[pa.RecordBatch]) -> list[dict]:
+    return [row for batch in batches for row in batch.to_pylist()]
+
+
+def _ndjson_batch(batch: pa.RecordBatch) -> bytes:
+    lines = [json.dumps(row, ensure_ascii=False, default=_json_default) for row in batch.to_pylist()]
+    return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+
+
+async def as_async(batches: Iterable[pa.RecordBatch]) -> AsyncIterator[pa.RecordBatch]:
+    for batch in batches:
+        yield batch
+
+
+async def take_rows(batches: AsyncIterator[pa.RecordBatch], max_rows: int) -> AsyncIterator[pa.RecordBatch]:
+    """
+    Pass through at most `max_rows` rows. The source is still drained, which is cheap since
+    guarded queries return at most one extra row, so wrappers such as the result cache complete.
+    """
+    remaining = max_rows
+    async for batch in batches:
+        if remaining <= 0:
+            continue
+        if batch.num_rows > remaining:
+            batch = batch.slice(0, remaining)
+        remaining -= batch.num_rows
+        yield batch
+
+
+async def read_ahead(batches: AsyncIterator[pa.RecordBatch], max_rows: int) -> tuple[bool, AsyncIterator[pa.RecordBatch]]:
+    """
+    Read until more than `max_rows` rows came in or the batches ran out, so a stream can say
+    whether it is cut off before it starts. Returns that and all the batches, the read ones first.
+    """
+    buffered, rows = [], 0
+    while rows <= max_rows:
+        try:
+            batch = await anext(batches)
+        except StopAsyncIteration:
+            break
+        buffered.append(batch)
+        rows += batch.num_rows
+
+    async def replay() -> AsyncIterator[pa.RecordBatch]:
+        for batch in buffered:
+            yield batch
+        async for batch in batches:
+            yield batch
+
+    return rows > max_rows, replay()
+
+
+async def collect_records(batches: AsyncIterator[pa.RecordBatch]) -> list[dict]:
+    """Drain the batches and convert them to row dicts off the event loop."""
+    return await sql_executor.run(batch_records, [batch async for batch in batches])
+
+
+async def ndjson_rows(batches: AsyncIterator[pa.RecordBatch]) -> AsyncIterator[bytes]:
+    """One JSON object per row, encoded a record batch at a time on the SQL pool."""
+    async for batch in batches:
+        if chunk := await sql_executor.run(_ndjson_batch, batch):
+            yield chunk
+
+
+async def arrow_stream(schema: pa.Schema, batches: AsyncIterator[pa.RecordBatch]) -> AsyncIterator[bytes]:
+    """Arrow IPC stream format, flushed after every record batch."""
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        async for batch in batches:
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+def _execute(
+    cursor: duckdb.DuckDBPyConnection, statements: list[str], batch_size: int, check: Callable | None = None
+) -> pa.RecordBatchReader:
+    for statement in statements[:-1]:
+        if check is not None:
+            check(cursor, statement)
+        cursor.execute(statement)
+    if check is not None:
+        check(cursor, statements[-1])
+    return cursor.execute(statements[-1]).fetch_record_batch(batch_size)
+
+
+def _read_batch(reader: pa.RecordBatchReader) -> pa.RecordBatch | None:
+    try:
+        return reader.read_next_batch()
+    except StopIteration:
+        return None
+
+
+def open_cursor(db: duckdb.DuckDBPyConnection, search_path: str | None = None) -> duckdb.DuckDBPyConnection:
+    """A cursor of its own on the connection, resolving unqualified names along `search_path` if given."""
+    cursor = db.cursor()
+    if search_path is not None:
+        cursor.execute(f"SET search_path = '{search_path}'")
+    return cursor
+
+
+async def execute_reader(
+    db: duckdb.DuckDBPyConnection,
+    sql: str | list[str],
+    batch_size: int = SQL_BATCH_SIZE,
+    timeout: float | None = None,
+    search_path: str | None = None,
+    check: Callable | None = None,
+) -> tuple[duckdb.DuckDBPyConnection, pa.RecordBatchReader]:
+    """
+    Run the SQL on the pool with a cursor of its own and return it with a streaming record-batch
+    reader. DuckDB materializes the result while executing, so `timeout` bounds the query itself;
+    on expiry the query is interrupted and `asyncio.TimeoutError` raised. A list of statements
+    runs in order on the cursor, each passed to `check(cursor, statement)` right before it
+    runs (so it sees the tables earlier ones created), and the reader returns the last result.
+    """
+    statements = [sql] if isinstance(sql, str) else sql
+    cursor = open_cursor(db, search_path)
+    try:
+        reader = await asyncio.wait_for(sql_executor.run(_execute, cursor, statements, batch_size, check, cursor=cursor), timeout)
+    except BaseException:
+        cursor.close()
+        raise
+    return cursor, reader
+
+
+async def iter_batches(cursor: duckdb.DuckDBPyConnection, reader: pa.RecordBatchReader) -> AsyncIterator[pa.RecordBatch]:
+    """Drain the reader on the pool and close its cursor, also when the consumer stops early or disconnects."""
+    try:
+        while (batch := await sql_executor.run(_read_batch, reader, cursor=cursor)) is not None:
+            yield batch
+    finally:
+        cursor.close()
+
+
+async def fetch_all(db: duckdb.DuckDBPyConnection, sql: str, search_path: str | None = None) -> list[tuple]:
+    """Run a small query (DESCRIBE, metadata) on the pool and return all rows."""
+    cursor = open_cursor(db, search_path)
+    try:
+        return await sql_executor.run(lambda: cursor.execute(sql).fetchall(), cursor=cursor)
+    finally:
+        cursor.close()
+
+
+class ResultCursor:
+    """
+    An open query result that is read a page at a time. With `max_rows` the pages stop after
+    that many rows, and `truncated` tells whether the result had more.
+    """
+
+    def __init__(self, cursor: duckdb.DuckDBPyConnection, reader: pa.RecordBatchReader, page_size: int, max_rows: int | None = None):
+        self.cursor = cursor
+        self.reader = reader
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.schema = reader.schema
+        self.touched = time.monotonic()
+        self.served = 0
+        self.truncated = False
+
+        self._pending: list[pa.RecordBatch] = []
+        self._exhausted = False
+        self._lock = threading.Lock()
+
+    def _read(self) -> pa.RecordBatch | None:
+        if self._pending:
+            return self._pending.pop(0)
+        if self._exhausted:
+            return None
+        try:
+            return self.reader.read_next_batch()
+        except StopIteration:
+            self._exhausted = True
+            return None
+
+    def next_page(self) -> tuple[list[pa.RecordBatch], bool]:
+        """Return the next `page_size` rows and whether more rows follow."""
+        with self._lock:
+            self.touched = time.monotonic()
+            size = self.page_size if self.max_rows is None else min(self.page_size, self.max_rows - self.served)
+            page, rows = [], 0
+            while rows < size and (batch := self._read()) is not None:
+                take = min(size - rows, batch.num_rows)
+                page.append(batch.slice(0, take))
+                if take < batch.num_rows:
+                    self._pending.insert(0, batch.slice(take))
+                rows += take
+            self.served += rows
+
+            # Peek so the last page doesn't hand out a cursor that yields nothing
+            if (batch := self._read()) is not None:
+                self._pending.insert(0, batch)
+            if batch is not None and self.max_rows is not None and self.served >= self.max_rows:
+                self.truncated = True
+                return page, False
+            return page, batch is not None
+
+    def close(self) -> None:
+        # Waits for a page being read, so the cursor is never closed under a running query
+        with self._lock:
+            self.cursor.close()
+
+
+class ResultCursors:
+    """Open paginated results by token, closed once drained, idle for `ttl` seconds or evicted."""
+
+    def __init__(self, max_cursors: int = 64, ttl: float = 300.0):
+        self.max_cursors = max_cursors
+        self.ttl = ttl
+
+        self._cursors: OrderedDict[str, ResultCursor] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self) -> list[ResultCursor]:
+        now = time.monotonic()
+        expired = [token for token, cursor in self._cursors.items() if now - cursor.touched >= self.ttl]
+        closed = [self._cursors.pop(token) for token in expired]
+        while len(self._cursors) > self.max_cursors:
+            closed.append(self._cursors.popitem(last=False)[1])
+        return closed
+
+    def open(self, cursor: ResultCursor) -> str:
+        token = secrets.token_urlsafe(16)
+        with self._lock:
+            self._cursors[token] = cursor
+            closed = self._expire()
+        for expired in closed:
+            expired.close()
+        return token
+
+    def get(self, token: str) -> ResultCursor | None:
+        with self._lock:
+            closed = self._expire()
+            cursor = self._cursors.get(token)
+            if cursor is not None:
+                self._cursors.move_to_end(token)
+        for expired in closed:
+            expired.close()
+        return cursor
+
+    def close(self, token: str) -> None:
+        with self._lock:
+            cursor = self._cursors.pop(token, None)
+        if cursor is not None:
+            cursor.close()
+
+    async def page(self, token: str, cursor: ResultCursor) -> tuple[list[pa.RecordBatch], str | None]:
+        """Read the next page on the SQL pool; returns the token to continue with, or None once drained."""
+        try:
+            batches, more = await sql_executor.run(cursor.next_page, cursor=cursor.cursor)
+        except BaseException:
+            # A failed or interrupted read leaves the reader unusable
+            self.close(token)
+            raise
+        if not more:
+            self.close(token)
+            return batches, None
+        return batches, token
+
+
+class SQLResultCache:
+    """
+    Arrow results of read-only queries, keyed by the canonical SQL and the versions
+    of the tables it references, so a reloaded table never serves stale rows.
+    """
+
+    def __init__(self, max_bytes: int, max_result_bytes: int):
+        self._cache = SizedLRUCache(max_bytes, max_result_bytes)
+
+    @staticmethod
+    def key(sql: str, versions: dict[str, int]) -> tuple | None:
+        """Cache key of the query, or None if its result can't be cached."""
+        canonical = canonical_sql(sql)
+        if not is_read_query(canonical) or _VOLATILE_SQL_RE.search(canonical):
+            return None
+        try:
+            if len(split_statements(sql)) != 1:
+                return None  # a script may change what later queries see
+        except duckdb.Error:
+            return None
+        return canonical, tuple(sorted(versions.items()))
+
+    def get(self, key: tuple) -> pa.Table | None:
+        return self._cache.get(key)
+
+    async def collect(self, key: tuple, schema: pa.Schema, batches: AsyncIterator[pa.RecordBatch]) -> AsyncIterator[pa.RecordBatch]:
+        """Pass the batches through and cache the complete result if it stays under the size limit."""
+        seen: list[pa.RecordBatch] | None = []
+        size = 0
+        async for batch in batches:
+            if seen is not None:
+                size += batch.nbytes
+                if size <= self._cache.max_item_bytes:
+                    seen.append(batch)
+                else:
+                    seen = None
+            yield batch
+
+        if seen is not None:
+            self._cache.set(key, pa.Table.from_batches(seen, schema=schema), size)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+sql_executor = SQLExecutor(SQL_WORKERS)
+sql_cursors = ResultCursors(SQL_MAX_CURSORS, SQL_CURSOR_TTL)
+sql_cache = SQLResultCache(SQL_CACHE_MAX_BYTES, SQL_CACHE_MAX_RESULT_BYTES)
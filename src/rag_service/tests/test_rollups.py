@@ -0,0 +1,82 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from config import SQL_ROLLUPS
+from excel_store import ExcelCatalog
+from rollups import RollupRegistry
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+# Aggregations a rollup covers; the rewrite must return the same rows as the original
+COVERED = [
+    'SELECT Segment, SUM(Profit) AS total FROM financial_sample GROUP BY Segment ORDER BY Segment',
+    'SELECT Country, COUNT(*), AVG("Units Sold") FROM financial_sample GROUP BY Country ORDER BY Country',
+    'SELECT Year, MIN("Sale Price"), MAX("Sale Price"), COUNT(Discounts) FROM financial_sample '
+    "WHERE Segment = 'Government' GROUP BY Year ORDER BY Year",
+    'SELECT Product, SUM(Profit) AS total FROM financial_sample GROUP BY Product HAVING total > 0 ORDER BY total DESC',
+    'SELECT COUNT(1), SUM(" Sales") FROM financial_sample',
+    'SELECT "Month Name", SUM("Gross Sales") FROM financial_sample WHERE Year = 2014 '
+    'GROUP BY "Month Name", "Month Number" ORDER BY "Month Number"',
+]
+
+# Queries a rollup can't answer, or can't answer unambiguously; they must run as written
+NOT_COVERED = [
+    # The alias shadows the Profit column, which WHERE filters before aggregation
+    'SELECT Country, SUM(Profit) AS Profit FROM financial_sample WHERE Profit > 0 GROUP BY Country ORDER BY Country',
+    'SELECT Country, SUM(Profit) AS total FROM financial_sample WHERE total > 0 GROUP BY Country',
+    'SELECT Segment, COUNT(NULL) FROM financial_sample GROUP BY Segment ORDER BY Segment',
+    'SELECT Segment, COUNT(DISTINCT Country) FROM financial_sample GROUP BY Segment',
+    'SELECT Segment, SUM(Profit * 2) FROM financial_sample GROUP BY Segment',
+    'SELECT Segment, "Units Sold" FROM financial_sample',
+]
+
+
+@pytest.fixture(scope="module")
+def registry(tmp_path_factory):
+    catalog = ExcelCatalog(DATA_DIR, tmp_path_factory.mktemp("cache"))
+    catalog.load()
+    registry = RollupRegistry(catalog, SQL_ROLLUPS)
+    asyncio.run(registry.refresh())
+    return registry
+
+
+@pytest.fixture
+def cursor(registry):
+    cursor = registry.catalog.db.cursor()
+    yield cursor
+    cursor.close()
+
+
+@pytest.mark.parametrize("sql", COVERED)
+def test_rewrite_returns_the_original_rows(registry, cursor, sql):
+    rewrite = registry.rewrite(cursor, sql)
+    assert rewrite is not None
+    _, rewritten = rewrite
+
+    original = cursor.execute(sql)
+    expected, columns = original.fetchall(), [column[0] for column in original.description]
+    actual = cursor.execute(rewritten)
+    assert [column[0] for column in actual.description] == columns
+    rows = actual.fetchall()
+    assert len(rows) == len(expected)
+    for row, expected_row in zip(rows, expected):
+        assert row == pytest.approx(expected_row)
+
+
+@pytest.mark.parametrize("sql", COVERED)
+def test_rewrite_keeps_the_column_types(registry, cursor, sql):
+    _, rewritten = registry.rewrite(cursor, sql)
+    assert cursor.execute(rewritten).arrow().schema == cursor.execute(sql).arrow().schema
+
+
+@pytest.mark.parametrize("sql", NOT_COVERED)
+def test_uncovered_queries_are_left_alone(registry, cursor, sql):
+    assert registry.rewrite(cursor, sql) is None
+
+
+def test_count_null_counts_nothing(registry, cursor):
+    sql = "SELECT COUNT(NULL) FROM financial_sample"
+    rewrite = registry.rewrite(cursor, sql)
+    assert cursor.execute(rewrite[1] if rewrite else sql).fetchone()[0] == 0
@@ -0,0 +1,188 @@
+import asyncio
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+import duckdb
+
+from config import VALUE_DICT_MAX_VALUES, VALUE_MATCH_THRESHOLD
+from excel_store import ExcelCatalog, excel_tables, sql_identifier
+from sql_results import sql_executor
+
+# Column types whose distinct values go into the dictionary
+VALUE_TYPES = ("VARCHAR", "ENUM")
+
+
+def normalize_value(text: str) -> str:
+    """Case-, accent- and punctuation-insensitive form, with plurals folded: "Côte d'Ivoire's" ➜ "cote d ivoire"."""
+    text = unicodedata.normalize("NFD", str(text).casefold())
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    words = re.findall(r"\w+", text)
+    return " ".join(_singular(word) for word in words)
+
+
+def _singular(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("ches", "shes", "sses", "xes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def trigrams(normalized: str) -> Counter:
+    padded = f"  {normalized} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class ValueDictionary:
+    """
+    The distinct values of a table's text columns with a trigram index over their
+    normalized form, to map a user's spelling of a value to the one stored.
+    """
+
+    def __init__(self, table: str, version: int, values: dict[str, list[tuple[str, int]]]):
+        self.table = table
+        self.version = version
+        self.columns = list(values)
+
+        self._entries: list[tuple[str, str, int, str, Counter]] = []  # (column, value, count, normalized, trigrams)
+        self._exact: dict[str, list[int]] = {}
+        self._postings: dict[str, list[int]] = {}
+        for column, rows in values.items():
+            for value, count in rows:
+                normalized = normalize_value(value)
+                grams = trigrams(normalized)
+                entry = len(self._entries)
+                self._entries.append((column, value, count, normalized, grams))
+                self._exact.setdefault(normalized, []).append(entry)
+                for gram in grams:
+                    self._postings.setdefault(gram, []).append(entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def resolve(self, term: str, k: int = 3, threshold: float = 0.5, columns: list[str] | None = None) -> list[dict]:
+        """
+        The stored values closest to the term, best first: exact matches after normalization
+        score 1.0, the others the Dice coefficient of their trigrams, kept from `threshold` up.
+        """
+        normalized = normalize_value(term)
+        if not normalized:
+            return []
+        allowed = set(columns) if columns is not None else None
+
+        scores: dict[int, float] = {entry: 1.0 for entry in self._exact.get(normalized, [])}
+        grams = trigrams(normalized)
+        size = sum(grams.values())
+        shared: Counter = Counter()
+        for gram, count in grams.items():
+            for entry in self._postings.get(gram, ()):
+                shared[entry] += min(count, self._entries[entry][4][gram])
+        for entry, common in shared.items():
+            if entry not in scores:
+                scores[entry] = 2 * common / (size + sum(self._entries[entry][4].values()))
+
+        matches = [
+            (score, self._entries[entry])
+            for entry, score in scores.items()
+            if score >= threshold and (allowed is None or self._entries[entry][0] in allowed)
+        ]
+        matches.sort(key=lambda match: (-match[0], -match[1][2]))
+        return [
+            {"column": column, "value": value, "score": round(score, 3), "rows": count}
+            for score, (column, value, count, _, _) in matches[:k]
+        ]
+
+
+class ValueDictionaries:
+    """
+    One `ValueDictionary` per table, built when a table version is ingested and shared by
+    concurrent callers. Columns with more than `max_values` distinct values (ids, free text)
+    are left out, since their values are not a vocabulary users filter on.
+    """
+
+    def __init__(self, catalog: ExcelCatalog, max_values: int = 10_000, threshold: float = 0.5):
+        self.catalog = catalog
+        self.max_values = max_values
+        self.threshold = threshold
+
+        self._dictionaries: dict[str, ValueDictionary] = {}
+        self._pending: dict[tuple[str, int], asyncio.Future] = {}
+        self._lock = threading.Lock()
+
+    def _collect(self, cursor: duckdb.DuckDBPyConnection, table: str, version: int) -> ValueDictionary:
+        values = {}
+        for column, dtype in self.catalog.tables[table]["schema"].items():
+            if not dtype.startswith(VALUE_TYPES):
+                continue
+            rows = cursor.execute(
+                f"SELECT {sql_identifier(column)}::VARCHAR, count(*) FROM {sql_identifier(table)} "
+                f"WHERE {sql_identifier(column)} IS NOT NULL GROUP BY 1 LIMIT {self.max_values + 1}"
+            ).fetchall()
+            if len(rows) <= self.max_values:
+                values[column] = rows
+        return ValueDictionary(table, version, values)
+
+    async def _build(self, table: str, version: int) -> ValueDictionary:
+        cursor = self.catalog.db.cursor()
+        try:
+            return await sql_executor.run(self._collect, cursor, table, version, cursor=cursor)
+        finally:
+            cursor.close()
+
+    async def get(self, table: str) -> ValueDictionary:
+        """The dictionary of the table's current version, built on first use; concurrent callers share one build."""
+        version = self.catalog.tables[table]["version"]
+        with self._lock:
+            cached = self._dictionaries.get(table)
+        if cached is not None and cached.version == version:
+            return cached
+
+        key = (table, version)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = asyncio.ensure_future(self._build(table, version))
+        try:
+            dictionary = await asyncio.shield(pending)
+        finally:
+            if pending.done():
+                self._pending.pop(key, None)
+
+        with self._lock:
+            current = self._dictionaries.get(table)
+            if current is None or current.version < version:
+                self._dictionaries[table] = dictionary
+        return dictionary
+
+    async def warm(self) -> None:
+        """Build the dictionary of every table ahead of the first request and forget removed tables."""
+        with self._lock:
+            for table in set(self._dictionaries) - set(self.catalog.tables):
+                del self._dictionaries[table]
+        for table in list(self.catalog.tables):
+            try:
+                await self.get(table)
+            except Exception as exc:
+                print(f"[WARN] Could not build the value dictionary of table '{table}': {exc}")
+
+    async def resolve(
+        self, table: str, terms: list[str], k: int = 3, columns: list[str] | None = None, threshold: float | None = None
+    ) -> list[dict]:
+        """The best stored matches of each term (see `ValueDictionary.resolve`)."""
+        dictionary = await self.get(table)
+        threshold = self.threshold if threshold is None else threshold
+        return [{"term": term, "matches": dictionary.resolve(term, k, threshold, columns)} for term in terms]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tables": len(self._dictionaries),
+                "values": sum(len(dictionary) for dictionary in self._dictionaries.values()),
+                "pending": len(self._pending),
+            }
+
+
+value_dictionaries = ValueDictionaries(excel_tables, VALUE_DICT_MAX_VALUES, VALUE_MATCH_THRESHOLD)
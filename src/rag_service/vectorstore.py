@@ -0,0 +1,237 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+import chromadb
+from chromadb.api import ClientAPI
+from chromadb.api.models.Collection import Collection
+from chromadb.errors import ChromaError
+from langchain_chroma import Chroma
+
+from caches import TTLCache
+from config import (
+    RAG_HOST,
+    RAG_PORT,
+    settings,
+    CHROMA_MAX_COLLECTIONS,
+    CHROMA_COLLECTION_TTL,
+    CHROMA_HEALTH_INTERVAL,
+    CHROMA_VERSION_INTERVAL,
+    RESULT_CACHE_SIZE,
+    RESULT_CACHE_TTL,
+)
+from embeddings import get_embeddings
+
+
+class ChromaPool:
+    """
+    Long-lived Chroma client plus an LRU cache of per-collection handles.
+
+    Chroma clients that point to the same host share one `System` and one pooled
+    `httpx.Client`, so a single client per process already gives us keep-alive
+    connections. What we avoid here is the per-request client construction
+    (tenant/database validation) and the `get_or_create_collection` lookup.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        max_collections: int = 32,
+        collection_ttl: float = 600.0,
+        health_interval: float = 30.0,
+        version_interval: float = 30.0,
+    ):
+        self.host = host
+        self.port = port
+        self.max_collections = max_collections
+        self.collection_ttl = collection_ttl
+        self.health_interval = health_interval
+        self.version_interval = version_interval
+
+        self._client: ClientAPI | None = None
+        self._handles: OrderedDict[str, tuple[Chroma, float]] = OrderedDict()
+        self._versions: dict[str, tuple[tuple, float]] = {}
+        self._last_heartbeat = 0.0
+        self._lock = threading.RLock()
+
+    # ----------------------------------------------------------------------------------
+    # Lifecycle
+    # ----------------------------------------------------------------------------------
+    def start(self) -> None:
+        """Connect eagerly so the first request doesn't pay the setup cost."""
+        try:
+            self._connect()
+        except Exception as exc:
+            # The vector db may still be booting; we retry lazily on first use.
+            print(f"[WARN] Could not connect to Chroma at {self.host}:{self.port}: {exc}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._handles.clear()
+            self._client = None
+            self._last_heartbeat = 0.0
+
+    def _connect(self) -> ClientAPI:
+        with self._lock:
+            self._client = chromadb.HttpClient(host=self.host, port=self.port, settings=settings)
+            self._client.heartbeat()
+            self._last_heartbeat = time.monotonic()
+            self._handles.clear()
+            return self._client
+
+    @property
+    def client(self) -> ClientAPI:
+        """Return a healthy client, reconnecting if the last heartbeat failed."""
+        with self._lock:
+            if self._client is None:
+                return self._connect()
+
+            if time.monotonic() - self._last_heartbeat > self.health_interval:
+                try:
+                    self._client.heartbeat()
+                    self._last_heartbeat = time.monotonic()
+                except Exception:
+                    return self._connect()
+            return self._client
+
+    # ----------------------------------------------------------------------------------
+    # Collection handles
+    # ----------------------------------------------------------------------------------
+    def get(self, collection_name: str) -> Chroma:
+        """Return a cached LangChain `Chroma` wrapper for the collection."""
+        client = self.client
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._handles.get(collection_name)
+            if cached is not None and now - cached[1] < self.collection_ttl:
+                self._handles.move_to_end(collection_name)
+                return cached[0]
+
+        vectordb = Chroma(
+            client=client,
+            collection_name=collection_name,
+            embedding_function=get_embeddings(collection_name),
+        )
+
+        with self._lock:
+            self._handles[collection_name] = (vectordb, now)
+            self._handles.move_to_end(collection_name)
+            while len(self._handles) > self.max_collections:
+                self._handles.popitem(last=False)
+        return vectordb
+
+    async def aget(self, collection_name: str) -> Chroma:
+        """Async variant of `get`; the blocking lookups run off the event loop."""
+        return await asyncio.to_thread(self.get, collection_name)
+
+    def collection(self, collection_name: str) -> Collection:
+        """Return the raw Chroma collection behind the cached handle."""
+        return self.get(collection_name)._collection
+
+    async def acollection(self, collection_name: str) -> Collection:
+        return await asyncio.to_thread(self.collection, collection_name)
+
+    def query(
+        self,
+        collection_name: str,
+        query_embeddings: list[list[float]],
+        k: int,
+        where: dict | None = None,
+        where_document: dict | None = None,
+    ) -> list[list[dict]]:
+        """
+        Run one multi-embedding Chroma query and return one result list per embedding.
+        Every document carries its `distance` to the query.
+        """
+        results = self.collection(collection_name).query(
+            query_embeddings=query_embeddings,
+            n_results=k,
+            where=where or None,
+            where_document=where_document or None,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            [
+                {"id": doc_id, "content": content, "metadata": metadata or {}, "distance": distance}
+                for doc_id, content, metadata, distance in zip(ids, documents, metadatas, distances)
+            ]
+            for ids, documents, metadatas, distances in zip(
+                results["ids"], results["documents"], results["metadatas"], results["distances"]
+            )
+        ]
+
+    async def aquery(self, collection_name: str, query_embeddings: list[list[float]], k: int, **filters) -> list[list[dict]]:
+        return await asyncio.to_thread(self.query, collection_name, query_embeddings, k, **filters)
+
+    def filter_ids(self, collection_name: str, where: dict | None = None, where_document: dict | None = None) -> set[str]:
+        """Return the ids of the documents that pass the metadata/document filters."""
+        records = self.collection(collection_name).get(
+            where=where or None,
+            where_document=where_document or None,
+            include=[],
+        )
+        return set(records["ids"])
+
+    async def afilter_ids(self, collection_name: str, where: dict | None = None, where_document: dict | None = None) -> set[str]:
+        return await asyncio.to_thread(self.filter_ids, collection_name, where, where_document)
+
+    def embeddings(self, collection_name: str, ids: list[str]) -> dict[str, list[float]]:
+        """Return the stored embeddings of the given document ids."""
+        if not ids:
+            return {}
+        records = self.collection(collection_name).get(ids=ids, include=["embeddings"])
+        return {doc_id: list(vector) for doc_id, vector in zip(records["ids"], records["embeddings"])}
+
+    async def aembeddings(self, collection_name: str, ids: list[str]) -> dict[str, list[float]]:
+        return await asyncio.to_thread(self.embeddings, collection_name, ids)
+
+    def version(self, collection_name: str) -> tuple | None:
+        """
+        Return a version stamp for the collection: its id, document count and the
+        optional `version` metadata key set by the ingestion scripts. The stamp is
+        refreshed at most every `version_interval` seconds; None if it doesn't exist.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(collection_name)
+            if cached is not None and now - cached[1] < self.version_interval:
+                return cached[0]
+
+        try:
+            collection = self.client.get_collection(collection_name)
+            stamp = (str(collection.id), collection.count(), (collection.metadata or {}).get("version"))
+        except ChromaError:
+            return None
+
+        with self._lock:
+            self._versions[collection_name] = (stamp, now)
+        return stamp
+
+    async def aversion(self, collection_name: str) -> tuple | None:
+        return await asyncio.to_thread(self.version, collection_name)
+
+    def invalidate(self, collection_name: str | None = None) -> None:
+        """Drop one (or every) cached handle, e.g. after a collection is recreated."""
+        with self._lock:
+            if collection_name is None:
+                self._handles.clear()
+                self._versions.clear()
+            else:
+                self._handles.pop(collection_name, None)
+                self._versions.pop(collection_name, None)
+
+
+chroma_pool = ChromaPool(
+    host=RAG_HOST,
+    port=int(RAG_PORT),
+    max_collections=CHROMA_MAX_COLLECTIONS,
+    collection_ttl=CHROMA_COLLECTION_TTL,
+    health_interval=CHROMA_HEALTH_INTERVAL,
+    version_interval=CHROMA_VERSION_INTERVAL,
+)
+
+# Retrieved documents keyed by (collection, version stamp, normalized query, k)
+result_cache = TTLCache(max_items=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)